@@ -1,41 +1,60 @@
-from flask import Flask, render_template, request, send_file
-from PIL import Image, ImageDraw, ImageFont
-import os
+from flask import Flask, render_template, request, make_response
+from utils.font_stack import get_font_stack
+from utils.layout import layout_text
+from utils.raster import render_page
+from utils.encode import encode_image
+from utils.render_output import data_uri, send_bytes, is_fresh, not_modified
+from utils.render_cache import RenderCache, render_key
+from utils.admission import AdmissionControl, Rejected, render_cost
 
 app = Flask(__name__)
 
+render_cache = RenderCache()
+# Renders run on a small bounded pool rather than in the request thread
+admission = AdmissionControl(workers=2, max_queue=16)
+
+@app.errorhandler(Rejected)
+def rejected(error):
+    headers = {"Retry-After": str(error.retry_after)} if error.retry_after else {}
+    return error.message, error.status, headers
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    output_path = 'static/output.png'
-
     if request.method == 'POST':
         text = request.form['text']
-        font_path = 'master_ttf\MyHandwriting.ttf'
+        font_path = 'master_ttf/MyHandwriting.ttf'
         font_size = 40
-
-        # Create a blank image
-        img = Image.new('RGB', (1200, 800), color='white')
-        draw = ImageDraw.Draw(img)
-
-        # Load handwriting-like font
-        font = ImageFont.truetype(font_path, font_size)
-
-        # Draw text line by line
-        x, y = 40, 40
-        line_height = font_size + 20
-        for line in text.split('\n'):
-            draw.text((x, y), line, font=font, fill='black')
-            y += line_height
-
-        img.save(output_path)
-
-        return render_template('index.html', output_image=output_path)
+        # Handwriting font first, a system font for anything it lacks
+        font = get_font_stack(font_path)
+
+        as_png = request.args.get('format') == 'png'
+        key = render_key(font.hash, text, font_size, "png", page_width=1200,
+                         margin=40, line_height=font_size + 20)
+        etag = key if as_png else key + "-page"
+        if is_fresh(etag):
+            return not_modified(etag)
+        cost = render_cost(len(text), font_size)
+        admission.check(text, cost)
+
+        def render():
+            # Wrap to the canvas width; the canvas grows to fit the text
+            pages = layout_text(font, text, font_size, page_width=1200,
+                                margin=40, line_height=font_size + 20)
+            return encode_image(render_page(pages[0], font, font_size))[0]
+
+        # Encoded in memory and sent back with this response, nothing is
+        # written to disk or shared between requests
+        image = render_cache.get(key)
+        if image is None:
+            image = admission.run(request.remote_addr, cost, lambda: render_cache.get_or_create(key, render))
+        if as_png:
+            return send_bytes(image, "image/png", etag=key)
+
+        response = make_response(render_template('index.html', output_image=data_uri(image)))
+        response.set_etag(etag)
+        return response
 
     return render_template('index.html', output_image=None)
 
-@app.route('/download')
-def download():
-    return send_file('static/output.png', as_attachment=True)
-
 if __name__ == '__main__':
     app.run(debug=True)
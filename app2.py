@@ -1,23 +1,137 @@
-from flask import Flask, request, send_file, render_template_string, url_for
+from flask import Flask, Response, request, send_file, render_template_string, jsonify, make_response, url_for
+import io
 import os
-from PIL import Image, ImageDraw
-import freetype
-import uharfbuzz as hb
+import re
 from build_font import build_font
+from utils.glyph_cache import GlyphCache
+from utils.glyph_atlas import get_atlas
+from utils.jitter_atlas import get_jitter_atlas
+from utils.sdf_atlas import get_sdf_atlas, MIN_SIZE, MAX_SIZE
+from utils.font_registry import get_font
+from utils.font_stack import get_font_stack, fonts_of, DEFAULT_FALLBACKS
+from utils.shaping import default_cache as shaping_cache
+from utils.layout import layout_text
+from utils.layout_export import layout_json, layout_binary
+from utils.raster import render_page
+from utils.encode import encode_image, MIMETYPES, DEPTHS
+from utils.render_output import data_uri, send_bytes, is_fresh, not_modified
+from utils.render_cache import RenderCache, render_key
+from utils.pdf_export import export_pdf, A4_POINTS
+from utils.batch_render import BatchRenderer, parse_items
+from utils.live_preview import LiveSession, LiveSessions, sse_events
+from utils.progressive import BackgroundRenders, preview_size
+from utils.paper import PAPER_STYLES, paper_background, paper_layout
+from utils.admission import AdmissionControl, Rejected, render_cost
 
 app = Flask(__name__)
 
 UPLOAD_FOLDER = "svgs"
 FONT_FILE = "master_ttf/MyHandwriting.ttf"
 TEMPLATE_FILE = "handwriting_template.pdf"
-RENDERED_IMAGE = "static/rendered.png"
+# Digits, capitals and punctuation the handwriting font lacks come from these
+FALLBACK_FONTS = DEFAULT_FALLBACKS
+FONT_SIZE = 48
+PAGE_WIDTH = 1200
+PDF_FONT_SIZE = 20
+# Paged raster output: A4 at 150 DPI
+RASTER_DPI = 150
+RASTER_PAGE = (1240, 1754)
+PAGE_MIMETYPES = {"pdf": "application/pdf", "tiff": "image/tiff", "zip": "application/zip"}
+# Renders run on a bounded pool; longer texts or bigger images are refused
+RENDER_WORKERS = 2
+RENDER_QUEUE = 16
+MAX_TEXT_CHARS = 100_000
+# render_cost of the largest single image /render draws (about 50k characters at 48px)
+MAX_IMAGE_COST = 50_000
+# Set to a directory to keep finished renders on disk as well as in memory
+RENDER_CACHE_DIR = None
+
+# The default size and its progressive preview size
+ATLAS_SIZES = (FONT_SIZE, preview_size(FONT_SIZE))
+# Produce other sizes from the distance-field atlas instead of FreeType
+USE_SDF_ATLAS = False
+
+glyph_cache = GlyphCache(max_glyphs=2048)
+render_cache = RenderCache(max_bytes=64 * 1024 * 1024, directory=RENDER_CACHE_DIR)
+batch_renderer = None
+live_sessions = LiveSessions(max_sessions=256)
+# Full-resolution renders behind progressive previews
+background_renders = BackgroundRenders(render_cache)
+admission = AdmissionControl(workers=RENDER_WORKERS, max_queue=RENDER_QUEUE,
+                             max_chars=MAX_TEXT_CHARS, max_cost=MAX_IMAGE_COST)
+
+
+def load_fonts():
+    # Shared per-worker font objects, reloaded only when a file changes
+    return get_font_stack(FONT_FILE, FALLBACK_FONTS)
+
+
+def glyph_source(font):
+    # Packed, memory-mapped glyphs of the handwriting font shared by every
+    # worker; the SDF atlas or the LRU cache covers other sizes and fallbacks
+    primary = fonts_of(font)[0]
+    fallback = get_sdf_atlas(primary, fallback=glyph_cache) if USE_SDF_ATLAS else glyph_cache
+    return get_atlas(primary, ATLAS_SIZES, fallback=fallback)
+
+
+def jitter_source(font):
+    # Transformed variants of the handwriting font, built once per font version
+    return get_jitter_atlas(fonts_of(font)[0], ATLAS_SIZES, fallback=glyph_cache)
+
+
+def jitter_seed():
+    # ?jitter=1 draws varied glyphs; ?seed=N picks another, equally repeatable variation
+    if request.values.get('jitter') != '1':
+        return None
+    return request.values.get('seed', 0, type=int)
+
+
+def paper_option():
+    # ?paper=ruled|college|grid draws the text on that paper; anything else is plain
+    paper = request.values.get('paper')
+    return paper if paper in PAPER_STYLES else None
+
+
+def admitted(cost, work):
+    # Run the work on the render pool instead of the request thread
+    return admission.run(request.remote_addr, cost, work)
+
+
+def cached_render(key, cost, create):
+    # Cached outputs skip the queue; a render that outlives the wait still
+    # lands in the cache for the retry
+    data = render_cache.get(key)
+    if data is None:
+        data = admitted(cost, lambda: render_cache.get_or_create(key, create))
+    return data
+
+
+def get_batch_renderer():
+    global batch_renderer
+    # The pool is started on first use so plain page loads don't fork workers
+    if batch_renderer is None:
+        batch_renderer = BatchRenderer(FONT_FILE, size=FONT_SIZE, page_width=PAGE_WIDTH,
+                                       pdf_size=PDF_FONT_SIZE, fallbacks=FALLBACK_FONTS)
+    return batch_renderer
+
+
+# Build or map the atlas at import so a preloading server does it once in the
+# master process and forked workers start warm
+if os.path.exists(FONT_FILE):
+    glyph_source(load_fonts())
+    jitter_source(load_fonts())
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs("static", exist_ok=True)
+
+@app.errorhandler(Rejected)
+def rejected(error):
+    headers = {"Retry-After": str(error.retry_after)} if error.retry_after else {}
+    if request.path == "/layout":
+        return jsonify(error=error.message), error.status, headers
+    return error.message + " <br><a href='/'>Go Back</a>", error.status, headers
 
 @app.route('/')
-def home():
-    rendered = os.path.exists(RENDERED_IMAGE)
+def home(rendered=None, full_url=None, display_width=None):
     return render_template_string("""
     <!doctype html>
     <title>Font Builder</title>
@@ -41,15 +155,75 @@ def home():
     <h2>Render Preview</h2>
     <form method=post action="/render">
       <textarea name="text" rows="4" cols="50" placeholder="Type your text here..."></textarea><br>
+      Size: <input type=number name=size min=12 max=200 value=48><br>
+      Paper: <select name=paper>
+        <option value="">Plain</option>
+        <option value="ruled">Ruled</option>
+        <option value="college">College ruled</option>
+        <option value="grid">Grid</option>
+      </select><br>
+      <label><input type=checkbox name=jitter value=1> Vary the letters</label>
+      Seed: <input type=number name=seed value=0><br>
+      <label><input type=checkbox name=progressive value=1 checked> Show a quick preview first</label><br>
       <input type=submit value="Render">
+      <input type=submit value="Download PDF" formaction="/render/pdf">
     </form>
 
+    <h2>Live Preview</h2>
+    <textarea id="live-text" rows="4" cols="50" placeholder="Start typing..."></textarea><br>
+    <canvas id="live-canvas" width="{{ page_width }}" height="0"></canvas>
+    <script>
+    const sessionId = Math.random().toString(36).slice(2);
+    const canvas = document.getElementById("live-canvas");
+    const ctx = canvas.getContext("2d");
+    const events = new EventSource(`/live/${sessionId}/events`);
+    let applied = 0;
+    events.addEventListener("patch", async (e) => {
+      const patch = JSON.parse(e.data);
+      // Patches only apply on top of the one before; full ones stand alone
+      if (!patch.full && patch.version <= applied) return;
+      applied = patch.version;
+      // Resizing clears the canvas, so keep a copy of what was there
+      const old = document.createElement("canvas");
+      old.width = canvas.width; old.height = canvas.height;
+      if (!patch.full && canvas.height) old.getContext("2d").drawImage(canvas, 0, 0);
+      canvas.width = patch.width; canvas.height = patch.height;
+      ctx.fillStyle = "white"; ctx.fillRect(0, 0, canvas.width, canvas.height);
+      if (!patch.full && old.height) {
+        const y = patch.shift ? patch.shift.y : old.height;
+        const dy = patch.shift ? patch.shift.dy : 0;
+        ctx.drawImage(old, 0, 0, old.width, y, 0, 0, old.width, y);
+        if (old.height > y) ctx.drawImage(old, 0, y, old.width, old.height - y, 0, y + dy, old.width, old.height - y);
+      }
+      for (const tile of patch.tiles) {
+        const img = new Image();
+        img.src = tile.image;
+        await img.decode();
+        ctx.drawImage(img, 0, tile.y);
+      }
+    });
+    document.getElementById("live-text").addEventListener("input", (e) => {
+      fetch(`/live/${sessionId}`, {method: "POST", body: new URLSearchParams({text: e.target.value})});
+    });
+    </script>
+
     {% if rendered %}
         <h3>Preview:</h3>
-        <img src="{{ url_for('static', filename='rendered.png') }}" alt="Rendered Text"><br>
-        <a href="{{ url_for('static', filename='rendered.png') }}" download>Download Image</a>
+        <img id="rendered" src="{{ rendered }}" alt="Rendered Text"
+             {% if display_width %}width="{{ display_width }}"{% endif %}><br>
+        <a id="rendered-link" href="{{ full_url or rendered }}" download="rendered.png">Download Image</a>
+        {% if full_url %}
+        <script>
+        // Swap the low-resolution preview for the full render once it is ready
+        (async function poll() {
+          const response = await fetch("{{ full_url }}");
+          if (response.status === 202) return setTimeout(poll, 100);
+          if (response.ok) document.getElementById("rendered").src = URL.createObjectURL(await response.blob());
+        })();
+        </script>
+        {% endif %}
     {% endif %}
-    """, rendered=rendered)
+    """, rendered=rendered, full_url=full_url, display_width=display_width, page_width=PAGE_WIDTH)
 
 @app.route('/upload', methods=['POST'])
 def upload_files():
@@ -68,12 +242,19 @@ def upload_files():
 @app.route('/build', methods=['POST'])
 def build():
     build_font()
+    # Drop bitmaps, shaped words and renders from the previous font. Live
+    # sessions notice the new font hash themselves and start over.
+    glyph_cache.clear()
+    shaping_cache.clear()
+    render_cache.clear()
+    # Transform the new glyphs now rather than on the first render
+    jitter_source(load_fonts())
     return "🎉 Font built successfully! <br><a href='/'>Go Back</a>"
 
 @app.route('/download')
 def download():
     if os.path.exists(FONT_FILE):
-        return send_file(FONT_FILE, as_attachment=True)
+        return send_file(FONT_FILE, as_attachment=True, etag=get_font(FONT_FILE).hash)
     else:
         return "Font not built yet. <br><a href='/'>Go Back</a>", 404
 
@@ -84,56 +265,284 @@ def downloadTemplate():
     else:
         return "Template not available. <br><a href='/'>Go Back</a>", 404
 
-@app.route('/render', methods=['POST'])
+@app.route('/render', methods=['GET', 'POST'])
 def render_text():
-    text = request.form.get('text', '').strip()
+    text = request.values.get('text', '').strip()
     if not text:
         return "Text is empty. <br><a href='/'>Go Back</a>"
 
     if not os.path.exists(FONT_FILE):
         return "Font not built yet. <br><a href='/'>Go Back</a>", 404
 
-    face = freetype.Face(FONT_FILE)
-    face.set_char_size(48 * 64)
+    font = load_fonts()
+
+    size = min(max(request.values.get('size', FONT_SIZE, type=int), MIN_SIZE), MAX_SIZE)
+    # ?format=png|tiff returns the raw image; the preview page always embeds a PNG
+    fmt = request.args.get('format')
+    raw = fmt in MIMETYPES
+    if not raw:
+        fmt = "png"
+    depth = request.values.get('depth', 'gray')
+    if depth not in DEPTHS:
+        depth = "gray"
+    paper = paper_option()
+    seed = jitter_seed()
+    jitter = jitter_source(font) if seed is not None else None
 
-    # HarfBuzz shaping
-    font_bytes = open(FONT_FILE, 'rb').read()
-    hb_blob = hb.Blob(font_bytes)
-    hb_face = hb.Face(hb_blob)
-    hb_font = hb.Font(hb_face)
-    buf = hb.Buffer()
-    buf.add_str(text)
-    buf.guess_segment_properties()
-    features = {"calt": True}
-    hb.shape(hb_font, buf, features)
+    # The content address of the image is its ETag; the preview page gets its own
+    key = render_key(font.hash, text, size, fmt, depth=depth, page_width=PAGE_WIDTH, margin=20,
+                     sdf=USE_SDF_ATLAS, paper=paper, seed=seed)
+    etag = key if raw else key + "-page"
+    if is_fresh(etag):
+        return not_modified(etag)
+    cost = render_cost(len(text), size)
+    admission.check(text, cost)
 
-    infos = buf.glyph_infos
-    positions = buf.glyph_positions
+    def layout():
+        # Shape (calt, cached per word) and wrap to the preview width, on the
+        # rules of the paper (taken as RASTER_DPI) if there is one
+        spacing = paper_layout(paper, RASTER_DPI, font, size) if paper else {"margin": 20}
+        return layout_text(font, text, size, page_width=PAGE_WIDTH, **spacing)[0]
 
-    # Calculate total width and height
-    width = sum(pos.x_advance for pos in positions) // 64 + 40
-    height = face.size.height // 64 + 40
-    image = Image.new("RGB", (width, height), "white")
-    draw = ImageDraw.Draw(image)
+    def background(page, scale=1):
+        if not paper:
+            return None
+        width, height = max(1, round(page.width * scale)), max(1, round(page.height * scale))
+        return paper_background(paper, width, height, RASTER_DPI * scale)
 
-    pen_x, pen_y = 20, 20 + face.size.ascender // 64
+    def render(page=None):
+        page = page or layout()
+        canvas = render_page(page, font, size, glyph_source(font), background=background(page),
+                             jitter=jitter, seed=seed or 0)
+        return encode_image(canvas, fmt, depth)[0]
 
-    for info, pos in zip(infos, positions):
-        glyph_index = info.codepoint
-        face.load_glyph(glyph_index, freetype.FT_LOAD_RENDER)
-        bitmap = face.glyph.bitmap
-        top = face.glyph.bitmap_top
-        left = face.glyph.bitmap_left
+    if request.values.get('progressive') == '1' and render_cache.get(key) is None:
+        # Answer at once with small cached glyphs on the same layout, and let
+        # the full resolution render catch up in the background
+        small = preview_size(size)
+        scale = small / size
+
+        def render_preview():
+            page = layout()
+            canvas = render_page(page, font, small, glyph_source(font), scale=scale,
+                                 background=background(page, scale), jitter=jitter, seed=seed or 0)
+            return page, encode_image(canvas, "png", depth)[0]
+
+        page, preview = admitted(cost * scale * scale, render_preview)
+        full_url = url_for('render_result', fmt=fmt, key=key)
+        if raw:
+            # Not send_file: its passthrough response never runs call_on_close
+            response = Response(preview, mimetype="image/png")
+            response.headers["Link"] = f'<{full_url}>; rel="alternate"'
+        else:
+            response = make_response(home(data_uri(preview), full_url, page.width))
+        response.headers["Cache-Control"] = "no-store"
+        # Only start the full render once the preview is on its way out. It
+        # goes through admission at its full cost like any other render.
+        client = request.remote_addr
+        background_renders.announce(key)
+        response.call_on_close(lambda: background_renders.submit(
+            key, lambda work: admission.submit(client, cost, work), lambda: render(page)))
+        return response
+
+    # Encoded in memory and returned with this response, so concurrent users
+    # never share an output file
+    image = cached_render(key, cost, render)
+    if raw:
+        return send_bytes(image, MIMETYPES[fmt], etag=key)
+    response = make_response(home(data_uri(image)))
+    response.set_etag(etag)
+    return response
+
+@app.route('/render/result/<fmt>/<key>')
+def render_result(fmt, key):
+    # Full-resolution output of a progressive render: 202 until it is ready
+    if fmt not in MIMETYPES or not re.fullmatch(r"[0-9a-f]{64}", key):
+        return "Unknown render.", 404
+    if is_fresh(key):
+        return not_modified(key)
+    status, data = background_renders.status(key)
+    if status == "done":
+        return send_bytes(data, MIMETYPES[fmt], etag=key)
+    if status == "pending":
+        return Response(status=202, headers={"Retry-After": "1"})
+    if status == "rejected":
+        raise data
+    return "Unknown render.", 404
+
+@app.route('/layout', methods=['GET', 'POST'])
+def layout_only():
+    # Glyph ids and positions for clients that draw the handwriting themselves
+    text = request.values.get('text', '')
+    if not text.strip():
+        return jsonify(error="Text is empty."), 400
+
+    if not os.path.exists(FONT_FILE):
+        return jsonify(error="Font not built yet."), 404
+
+    font = load_fonts()
+    size = min(max(request.values.get('size', FONT_SIZE, type=int), MIN_SIZE), MAX_SIZE)
+    width = min(max(request.values.get('width', PAGE_WIDTH, type=int), size * 2), 20000)
+    height = request.values.get('height', type=int)
+    margin = min(max(request.values.get('margin', 20, type=int), 0), width // 4)
+    if height is not None and height <= 2 * margin + size:
+        return jsonify(error="Page height too small."), 400
+    mode = "optimal" if request.values.get('mode') == 'optimal' else "greedy"
+    binary = request.args.get('format') == 'binary'
+
+    key = render_key(font.hash, text, size, "layout-binary" if binary else "layout-json",
+                     width=width, height=height, margin=margin, mode=mode)
+    if is_fresh(key):
+        return not_modified(key)
+    # No canvas, so only the text length limit applies
+    admission.check(text, 0)
+
+    def create():
+        pages = layout_text(font, text, size, width, height, margin=margin, mode=mode)
+        return (layout_binary if binary else layout_json)(pages, font, size)
+
+    # No rasterizing or image encoding, only the shaping cache and line breaking
+    data = cached_render(key, len(text), create)
+    mimetype = "application/octet-stream" if binary else "application/json"
+    return send_bytes(data, mimetype, etag=key)
+
+@app.route('/live/<session_id>', methods=['POST'])
+def live_update(session_id):
+    # The patch goes out on the session's event stream, not in this response
+    if not re.fullmatch(r"[A-Za-z0-9_-]{1,64}", session_id):
+        return "Bad session id.", 400
+    if not os.path.exists(FONT_FILE):
+        return "Font not built yet.", 404
+
+    font = load_fonts()
+    size = min(max(request.values.get('size', FONT_SIZE, type=int), MIN_SIZE), MAX_SIZE)
+    text = request.values.get('text', '')
+    cost = render_cost(len(text), size)
+    admission.check(text, cost)
+    session, events = live_sessions.get(
+        session_id,
+        lambda: LiveSession(font, size, PAGE_WIDTH, margin=20, glyph_cache=glyph_source(font)),
+        lambda session: session is not None and session.font.hash == font.hash and session.size == size,
+    )
+    # An edit only redraws the lines it changed; a full patch draws them all
+    edit_cost = cost if session.needs_full or events.full() else 0
+    patch = admitted(edit_cost, lambda: session.update(text, events))
+    return jsonify(version=patch["version"]), 202
+
+@app.route('/live/<session_id>/events')
+def live_events(session_id):
+    if not re.fullmatch(r"[A-Za-z0-9_-]{1,64}", session_id):
+        return "Bad session id.", 400
+    # The session itself is created by the first update
+    _, events = live_sessions.get(session_id, lambda: None)
+    return Response(sse_events(events), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/render/pdf', methods=['GET', 'POST'])
+def render_pdf():
+    text = request.values.get('text', '').strip()
+    if not text:
+        return "Text is empty. <br><a href='/'>Go Back</a>"
+
+    if not os.path.exists(FONT_FILE):
+        return "Font not built yet. <br><a href='/'>Go Back</a>", 404
+
+    font = load_fonts()
+    paper = paper_option()
+    key = render_key(font.hash, text, PDF_FONT_SIZE, "pdf", page=A4_POINTS, margin=56, paper=paper)
+    if is_fresh(key):
+        return not_modified(key)
+    admission.check(text, 0)
+
+    def render():
+        # Vector text on A4 pages, laid out in points, over vector rules
+        spacing = paper_layout(paper, 72, font, PDF_FONT_SIZE) if paper else {"margin": 56}
+        pages = layout_text(font, text, PDF_FONT_SIZE, *A4_POINTS, **spacing)
+        output = io.BytesIO()
+        export_pdf(pages, font, PDF_FONT_SIZE, output, paper=paper)
+        return output.getvalue()
+
+    pdf = cached_render(key, len(text), render)
+    return send_bytes(pdf, "application/pdf", "handwriting.pdf", etag=key)
+
+@app.route('/render/pages', methods=['GET', 'POST'])
+def render_pages():
+    text = request.values.get('text', '').strip()
+    if not text:
+        return "Text is empty. <br><a href='/'>Go Back</a>"
+
+    if not os.path.exists(FONT_FILE):
+        return "Font not built yet. <br><a href='/'>Go Back</a>", 404
+
+    font = load_fonts()
+    size = min(max(request.values.get('size', FONT_SIZE, type=int), MIN_SIZE), MAX_SIZE)
+    fmt = request.args.get('format', 'pdf')
+    if fmt not in PAGE_MIMETYPES:
+        fmt = "pdf"
+    depth = request.values.get('depth', 'gray')
+    if depth not in DEPTHS or (depth == "palette" and fmt != "zip"):
+        depth = "gray"
+
+    paper = paper_option()
+    seed = jitter_seed()
+
+    # Pages come out in order, so the document bytes are stable
+    key = render_key(font.hash, text, size, "pages-" + fmt, depth=depth, page=RASTER_PAGE,
+                     dpi=RASTER_DPI, margin=80, paper=paper, seed=seed)
+    if is_fresh(key):
+        return not_modified(key)
+    # Pages bound the canvas size, so only the text length limit applies
+    admission.check(text, 0)
+
+    # Layout is cheap and serial; rasterizing the pages is spread over the pool
+    spacing = paper_layout(paper, RASTER_DPI, font, size) if paper else {"margin": 80}
+    pages = admitted(len(text), lambda: layout_text(font, text, size, *RASTER_PAGE, **spacing))
+    chunks = get_batch_renderer().iter_pages(pages, size, fmt, depth, RASTER_DPI, paper, seed)
+    chunks = admission.stream(request.remote_addr, render_cost(len(text), size), chunks)
+    response = Response(chunks, mimetype=PAGE_MIMETYPES[fmt],
+                        headers={"Content-Disposition": f"attachment; filename=handwriting.{fmt}"})
+    response.set_etag(key)
+    return response
+
+@app.route('/render/batch', methods=['POST'])
+def render_batch():
+    if not os.path.exists(FONT_FILE):
+        return "Font not built yet.", 404
 
-        glyph_image = Image.frombytes("L", (bitmap.width, bitmap.rows), bytes(bitmap.buffer))
-        image.paste(Image.merge("RGB", (glyph_image,)*3), (pen_x + left, pen_y - top))
+    try:
+        items = parse_items(request.get_data(), request.is_json)
+    except (ValueError, TypeError) as e:
+        return f"Bad batch: {e}", 400
+    if not items:
+        return "No texts given.", 400
+    font_hash = load_fonts().hash
+    batch_renderer = get_batch_renderer()
+    text = "".join(item for _, item in items)
 
-        pen_x += pos.x_advance // 64
-        pen_y += pos.y_advance // 64
+    if request.args.get('format') == 'pdf':
+        # The combined PDF is written in input order, so its bytes are stable
+        key = render_key(font_hash, items, PDF_FONT_SIZE, "batch-pdf", page=A4_POINTS, margin=56)
+        if is_fresh(key):
+            return not_modified(key)
+        # Pages bound the canvas size, so only the text length limit applies
+        admission.check(text, 0)
+        chunks = admission.stream(request.remote_addr, len(text), batch_renderer.iter_pdf(items))
+        response = Response(chunks, mimetype="application/pdf",
+                            headers={"Content-Disposition": "attachment; filename=batch.pdf"})
+        response.set_etag(key)
+        return response
 
+    # Every item is one image, held to the same limit as a single /render
+    admission.check(text, max(render_cost(len(item), FONT_SIZE) for _, item in items))
+    chunks = admission.stream(request.remote_addr, render_cost(len(text), FONT_SIZE),
+                              batch_renderer.iter_zip(items))
+    return Response(chunks, mimetype="application/zip",
+                    headers={"Content-Disposition": "attachment; filename=batch.zip"})
 
-    image.save(RENDERED_IMAGE)
-    return home()
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(glyphs=glyph_cache.stats(), shaping=shaping_cache.stats(),
+                   renders=render_cache.stats(), admission=admission.stats())
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -3,90 +3,89 @@ import fitz               # PyMuPDF
 from PIL import Image, ImageDraw
 import os
 
+CHARACTERS = "abcdefghijklmnopqrstuvwxyz"
+VARIANTS = 3
+# Trimmed off every side of a square so its printed border is not picked up
+# (3 pixels at 300 DPI)
+INSET_PT = 0.72
+
+def letter_squares(page_num, pw_pt, ph_pt):
+    """
+    Label ("a1", "a2", ...) and writing square, as a fitz.Rect in points with
+    y growing downwards, of every box on one template page.
+    """
+    # Template layout parameters (in points)
+    margin_pt = 40
+    grid_cols = 6  # Number of boxes in one row
+    grid_w_pt = (pw_pt - 2 * margin_pt) / grid_cols
+    grid_h_pt = 100  # Height of each box
+    square_size_pt = grid_h_pt * 0.6  # Size of the square (60% of the box height)
+    square_margin_pt = (grid_h_pt - square_size_pt) / 2  # To center the square inside the grid
+    gap_pt = 20
+    rows_per_page = int((ph_pt - 2 * margin_pt) // (grid_h_pt + gap_pt))
+
+    box_idx = page_num * (grid_cols * rows_per_page)
+    for row in range(rows_per_page):
+        for col in range(grid_cols):
+            if box_idx >= len(CHARACTERS) * VARIANTS:
+                return
+
+            ch = CHARACTERS[box_idx // VARIANTS]
+            var = (box_idx % VARIANTS) + 1
+
+            # The template draws boxes with y growing upwards; the page
+            # (and so the clip rectangle) has it growing downwards
+            x0_pt = margin_pt + col * grid_w_pt
+            y1_pt = ph_pt - margin_pt - row * (grid_h_pt + gap_pt)   # upper y
+            square_x0_pt = x0_pt + (grid_w_pt - square_size_pt) / 2
+            square_top_pt = ph_pt - (y1_pt - square_margin_pt)
+
+            square = fitz.Rect(square_x0_pt, square_top_pt,
+                               square_x0_pt + square_size_pt, square_top_pt + square_size_pt)
+            yield f"{ch}{var}", square + (INSET_PT, INSET_PT, -INSET_PT, -INSET_PT)
+            box_idx += 1
+
 def extract_letters(pdf_path="handwriting_template_filled_3.pdf",
                     output_dir="images",
                     dpi=300,
-                    debug=False):
+                    debug=False,
+                    letter_dpi=None):
+    """
+    Save every filled-in square of the template as a grayscale PNG. Only the
+    squares are rasterized, each clipped from the page at letter_dpi (dpi by
+    default), so no full-page image is made except for the debug one.
+    """
     os.makedirs(output_dir, exist_ok=True)
     doc = fitz.open(pdf_path)
-    characters = "abcdefghijklmnopqrstuvwxyz"
-    variants = 3
+    letter_dpi = letter_dpi or dpi
 
+    count = 0
     for page_num in range(len(doc)):
         page = doc.load_page(page_num)
         # PDF page size in points
         pw_pt, ph_pt = page.rect.width, page.rect.height
 
-        # Rasterize page at desired DPI
-        pix = page.get_pixmap(dpi=dpi)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-        # Optional debug drawer
+        # The page is interpreted (and its scan decoded) once, then each
+        # square is rendered from the display list
+        squares = list(letter_squares(page_num, pw_pt, ph_pt))
+        display_list = page.get_displaylist()
+        zoom = fitz.Matrix(letter_dpi / 72, letter_dpi / 72)
+        for label, square in squares:
+            pix = display_list.get_pixmap(matrix=zoom, clip=square, colorspace=fitz.csGRAY, alpha=False)
+            pix.save(os.path.join(output_dir, f"{label}.png"))
+        count += len(squares)
+
+        # Optional debug page with the squares that were cut out
         if debug:
+            pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+            img = Image.frombytes("L", [pix.width, pix.height], pix.samples).convert("RGB")
             draw = ImageDraw.Draw(img)
-
-        # scale factor from points → pixels
-        scale = pix.width / pw_pt
-
-        # Template layout parameters (in points)
-        margin_pt = 40
-        grid_cols = 6  # Number of boxes in one row
-        grid_w_pt = (pw_pt - 2 * margin_pt) / grid_cols
-        grid_h_pt = 100  # Height of each box
-        square_size_pt = grid_h_pt * 0.6  # Size of the square (60% of the box height)
-        square_margin_pt = (grid_h_pt - square_size_pt) / 2  # To center the square inside the grid
-        gap_pt = 20
-        rows_per_page = int((ph_pt - 2 * margin_pt) // (grid_h_pt + gap_pt))
-
-        box_idx = page_num * (grid_cols * rows_per_page)
-        for row in range(rows_per_page):
-            for col in range(grid_cols):
-                if box_idx >= len(characters) * variants:
-                    break
-
-                ch = characters[box_idx // variants]
-                var = (box_idx % variants) + 1
-                label = f"{ch}{var}"
-
-                # Compute box in PDF points
-                x0_pt = margin_pt + col * grid_w_pt
-                y1_pt = ph_pt - margin_pt - row * (grid_h_pt + gap_pt)   # upper y
-                y0_pt = y1_pt - grid_h_pt                                # lower y
-
-                # Compute the square's position inside the box
-                square_x0_pt = x0_pt + (grid_w_pt - square_size_pt) / 2
-                square_y0_pt = y1_pt - square_margin_pt - square_size_pt
-
-                # Convert to pixels
-                x0_px = int(x0_pt * scale)
-                y0_px = int((ph_pt - y1_pt) * scale)  # top in image coords
-                x1_px = int((x0_pt + grid_w_pt) * scale)
-                y1_px = int((ph_pt - y0_pt) * scale)  # bottom in image coords
-
-                square_x0_px = int(square_x0_pt * scale)
-                square_y0_px = int((ph_pt - square_y0_pt) * scale)
-                square_x1_px = int((square_x0_pt + square_size_pt) * scale)
-                square_y1_px = int((ph_pt - (square_y0_pt + square_size_pt)) * scale)
-
-                # Ensure square_y0_px <= square_y1_px (fix for the error)
-                if square_y0_px > square_y1_px:
-                    square_y0_px, square_y1_px = square_y1_px, square_y0_px
-
-                # Optional debug drawer
-                # if debug:
-                #     draw.rectangle([square_x0_px, square_y0_px, square_x1_px, square_y1_px],
-                #                    outline="blue", width=2)
-
-                # Crop the square region
-                crop = img.crop((square_x0_px + 3, square_y0_px + 3, square_x1_px - 3, square_y1_px - 3))
-                crop.save(os.path.join(output_dir, f"{label}.png"))
-
-                box_idx += 1
-
-        if debug:
+            scale = pix.width / pw_pt
+            for _, square in squares:
+                draw.rectangle([v * scale for v in square], outline="blue", width=2)
             img.save(os.path.join(output_dir, f"debug_page_{page_num+1}.png"))
 
-    print(f"✅ Extracted {box_idx} images into `{output_dir}/`")
+    print(f"✅ Extracted {count} images into `{output_dir}/`")
 
 if __name__ == "__main__":
     # Turn debug=True the first time so you can open debug_page_1.png
@@ -1,18 +1,14 @@
-import freetype
 import uharfbuzz as hb
-from PIL import Image, ImageDraw
+from utils.font_registry import get_font
+from utils.glyph_cache import rasterize_glyph, subpixel
+from utils.compositor import new_canvas, composite, to_image
+from utils.tile_raster import TileRasterizer, format_for
 
-def shape_text(text, font_path, features=None):
-    # Load the font face
-    face = freetype.Face(font_path)
-    face.set_char_size(48 * 64)  # 48 pt
-
-    with open(font_path, "rb") as fontfile:
-        fontdata = fontfile.read()
-
-    # Create HarfBuzz font from face
-    hb_font = hb.Font(hb.Face(fontdata))
-    hb_font.scale = (face.size.height, face.size.height)
+def shape_text(text, font_path, features=None, size=48):
+    # Cached face and HarfBuzz font for this size (48 pt by default)
+    font = get_font(font_path)
+    face = font.ft_face(size)
+    hb_font = font.hb_font(size)
 
     # Create and fill HarfBuzz buffer
     buf = hb.Buffer()
@@ -35,42 +31,44 @@ def shape_text(text, font_path, features=None):
     return face, glyph_info, glyph_positions
 
 
-def render_shaped_text(text, font_path, image_path, img_size=(800, 200)):
+def render_shaped_text(text, font_path, image_path, img_size=(800, 200), tiled=False):
     face, glyph_info, glyph_positions = shape_text(text, font_path)
 
-    # Create image
-    img = Image.new("RGB", img_size, (0,0,0))
-    draw = ImageDraw.Draw(img)
-
-    # Start position for text rendering
-    x, y = 50, 100
+    # Start position for text rendering, in 26.6 fixed point
+    x, y = 50 * 64, 100 * 64
 
+    placements = []
     for info, pos in zip(glyph_info, glyph_positions):
-        gid = info.codepoint
-        face.load_glyph(gid, freetype.FT_LOAD_RENDER)
-        bitmap = face.glyph.bitmap
-
-        top = face.glyph.bitmap_top
-        left = face.glyph.bitmap_left
-        w, h = bitmap.width, bitmap.rows
-
-        if w > 0 and h > 0:
-            glyph_img = Image.frombytes("L", (w, h), bytes(bitmap.buffer))
-            rgb_glyph = Image.merge("RGB", (glyph_img,)*3)
-            img.paste(rgb_glyph, (int(x + left), int(y - top)), glyph_img)
+        # Quarter-pixel x (font index 0, subpixel phase), whole-pixel y
+        gx, phase = subpixel(x)
+        placements.append((info.codepoint, gx, y // 64, 0, phase))
 
         # Advance position
-        x += pos.x_advance / 64
-        y += pos.y_advance / 64
-
-    # Save the result
-    img.save(image_path)
+        x += pos.x_advance
+        y -= pos.y_advance
+
+    if tiled:
+        # Very large images: rendered band by band straight into the file
+        tiles = TileRasterizer(*img_size, face, get_font(font_path).hash, 48, placements,
+                               ink=255, background=0, mode="alpha")
+        with open(image_path, "wb") as f:
+            tiles.write(f, format_for(image_path))
+    else:
+        # Create image
+        canvas = new_canvas(*img_size, background=0)
+        for glyph_id, gx, gy, _, phase in placements:
+            glyph = rasterize_glyph(face, glyph_id, phase)
+            composite(canvas, glyph.bitmap, gx + glyph.left, gy - glyph.top, ink=255)
+
+        # Save the result
+        to_image(canvas).save(image_path)
     print(f"✅ Saved image with contextual alternates: {image_path}")
 
 
 # === USAGE EXAMPLE ===
-text = "aabbbccdeeefghi sasasa"  # Modify this text to test `calt` behavior
-font_path = "master_ttf/MyHandwriting.ttf"  # Replace with your actual font path
-output_image = "shaped_text_output.png"
+if __name__ == "__main__":
+    text = "aabbbccdeeefghi sasasa"  # Modify this text to test `calt` behavior
+    font_path = "master_ttf/MyHandwriting.ttf"  # Replace with your actual font path
+    output_image = "shaped_text_output.png"
 
-render_shaped_text(text, font_path, output_image)
+    render_shaped_text(text, font_path, output_image)
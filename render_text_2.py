@@ -1,7 +1,8 @@
-import uharfbuzz as hb
-import freetype
-from PIL import Image, ImageDraw
-import numpy as np
+from utils.font_registry import get_font
+from utils.shaping import shape_text as shape_words
+from utils.glyph_cache import rasterize_glyph, subpixel
+from utils.compositor import new_canvas, composite, to_image
+from utils.tile_raster import TileRasterizer, format_for
 
 # Settings
 FONT_PATH = "master_ttf\MyHandwriting.ttf"
@@ -11,71 +12,55 @@ FONT_SIZE = 128
 MARGIN = 20
 EXTRA_SPACE = 400  # Add extra spacing after each space character
 
-def shape_text(fontdata, text):
-    face = freetype.Face(FONT_PATH)
-    face.set_char_size(FONT_SIZE * 64)
-
-    hb_font = hb.Font(hb.Face(fontdata))
-    buf = hb.Buffer()
-    buf.add_str(text)
-    buf.guess_segment_properties()
-    hb.shape(hb_font, buf, features={"calt": True})
-
-    infos = buf.glyph_infos
-    positions = buf.glyph_positions
-
+def shape_text(font, text):
+    # Advances and offsets stay in 26.6 fixed point, like HarfBuzz returns them
     glyphs = []
-    for info, pos in zip(infos, positions):
-        glyph_index = info.codepoint
-        x_advance = pos.x_advance / 64
-        y_advance = pos.y_advance / 64
-        x_offset = pos.x_offset / 64
-        y_offset = pos.y_offset / 64
-        glyphs.append((glyph_index, x_advance, y_advance, x_offset, y_offset))
+    for g in shape_words(font, text, FONT_SIZE):
+        glyphs.append((g.glyph_id, g.x_advance, g.y_advance, g.x_offset, g.y_offset))
 
     return glyphs
 
-def render_text(text):
-    with open(FONT_PATH, "rb") as f:
-        fontdata = f.read()
-
-    glyphs = shape_text(fontdata, text)
+def render_text(text, output=None):
+    """
+    Returns a PIL image, or with an output path (.png or .tif) renders in
+    bands straight into that file without building the whole canvas.
+    """
+    font = get_font(FONT_PATH)
+    glyphs = shape_text(font, text)
 
     # Calculate image size
-    img_width = int(sum(g[1] for g in glyphs) + 2 * MARGIN + text.count(' ') * EXTRA_SPACE)
+    img_width = -(-sum(g[1] for g in glyphs) // 64) + 2 * MARGIN + text.count(' ') * EXTRA_SPACE
     img_height = FONT_SIZE + 2 * MARGIN
-    image = Image.new("RGB", (img_width, img_height), color=(255, 255, 255))  # White background
-    draw = ImageDraw.Draw(image)
 
-    face = freetype.Face(FONT_PATH)
-    face.set_char_size(FONT_SIZE * 64)
+    face = font.ft_face(FONT_SIZE)
 
-    pen_x = MARGIN
+    # The pen is kept in 26.6 so advances never get truncated; each glyph is
+    # placed to a quarter pixel (font index 0, subpixel phase)
+    pen_x = MARGIN * 64
     pen_y = MARGIN
+    placements = []
     for i, (glyph_index, x_advance, y_advance, x_offset, y_offset) in enumerate(glyphs):
-        face.load_glyph(glyph_index, freetype.FT_LOAD_RENDER)
-        bitmap = face.glyph.bitmap
-        top = face.glyph.bitmap_top
-        left = face.glyph.bitmap_left
-
-        glyph_img = np.array(bitmap.buffer, dtype=np.uint8).reshape(bitmap.rows, bitmap.width)
-
-        y = int(pen_y + FONT_SIZE - top)
-        x = int(pen_x + x_offset + left)
-
-        for r in range(bitmap.rows):
-            for c in range(bitmap.width):
-                val = glyph_img[r, c]
-                if val > 0:
-                    if 0 <= (x+c) < image.width and 0 <= (y+r) < image.height:
-                        image.putpixel((x+c, y+r), (0, 0, 0))  # Black ink
+        x, phase = subpixel(pen_x + x_offset)
+        placements.append((glyph_index, x, pen_y + FONT_SIZE, 0, phase))
 
         pen_x += x_advance
 
         # Add extra spacing after space character
         if chr(glyph_index) == ' ':
-            pen_x += EXTRA_SPACE
+            pen_x += EXTRA_SPACE * 64
+
+    if output:
+        tiles = TileRasterizer(img_width, img_height, face, font.hash, FONT_SIZE, placements)
+        with open(output, "wb") as f:
+            tiles.write(f, format_for(output))
+        return output
+
+    canvas = new_canvas(img_width, img_height)
+    for glyph_index, x, y, _, phase in placements:
+        glyph = rasterize_glyph(face, glyph_index, phase)
+        composite(canvas, glyph.bitmap, x + glyph.left, y - glyph.top, mode="min")  # Black ink
 
+    image = to_image(canvas)
     return image
 
 if __name__ == "__main__":
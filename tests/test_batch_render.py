@@ -0,0 +1,21 @@
+import pytest
+
+from utils.batch_render import parse_items
+
+
+@pytest.mark.parametrize("body", ['{not json', '5', '"text"', '{"texts": 3}', '[["a"]]',
+                                  '[{"name": "a", "text": 5}]', '[{"name": 3, "text": "a"}]'])
+def test_malformed_json_batches_are_rejected(body):
+    with pytest.raises(ValueError):
+        parse_items(body, True)
+
+
+def test_names_are_safe_unique_file_names():
+    items = parse_items('[{"name": "../../evil", "text": "a"}, {"name": "a", "text": "b"},'
+                        ' {"name": "a", "text": "c"}, {"name": "..\\\\.hidden", "text": "d"}, "e"]', True)
+    assert [name for name, _ in items] == ["evil", "a", "a-2", "hidden", "0005"]
+    assert [text for _, text in items] == ["a", "b", "c", "d", "e"]
+
+
+def test_plain_text_has_one_item_per_line():
+    assert parse_items(b"first\n\n  second \n", False) == [("0001", "first"), ("0002", "second")]
@@ -0,0 +1,41 @@
+import os
+import shutil
+
+import numpy as np
+
+from utils.font_registry import get_font
+from utils.glyph_atlas import atlas_base, load_atlas, load_or_build_atlas, save_atlas
+
+FONT = "master_ttf/MyHandwriting.ttf"
+
+
+def test_only_the_current_generation_is_kept(tmp_path):
+    font = get_font(FONT)
+    base = atlas_base(font, str(tmp_path), sizes=(48,))
+    first = save_atlas(base, np.ones((4, 8), dtype=np.uint8), index=np.arange(3))
+    save_atlas(base, np.full((4, 8), 2, dtype=np.uint8), index=np.arange(3))
+
+    assert len([name for name in os.listdir(tmp_path) if name.endswith(".npy")]) == 1
+    pixels, arrays = load_atlas(base)
+    assert (pixels == 2).all() and arrays["index"].tolist() == [0, 1, 2]
+    # A worker that mapped the old generation still reads it
+    assert (first == 1).all()
+
+
+def test_atlases_of_old_font_versions_are_pruned(tmp_path):
+    path = str(tmp_path / "Hand.ttf")
+    shutil.copy(FONT, path)
+    old = load_or_build_atlas(get_font(path), (24,), str(tmp_path))
+    other = tmp_path / "Hand.bold.abcdefabcdef.atlas-24-index.npz"
+    other.touch()
+
+    with open(path, "ab") as f:
+        f.write(b"\0" * 4)
+    os.utime(path, ns=(1, 1))
+    font = get_font(path)
+    load_or_build_atlas(font, (24,), str(tmp_path))
+
+    names = os.listdir(tmp_path)
+    assert not [name for name in names if old.font_hash[:12] in name]
+    assert [name for name in names if font.hash[:12] in name]
+    assert other.name in names
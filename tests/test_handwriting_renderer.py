@@ -0,0 +1,102 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from utils import handwriting_renderer
+from utils.handwriting_renderer import find_boxes, load_segments
+
+
+def letter_row(gap, count=12, width=30, height=40):
+    """
+    A white sheet with one row of solid letters, gap pixels apart.
+    """
+    img = np.full((height + 40, 20 + count * (width + gap)), 255, dtype=np.uint8)
+    for i in range(count):
+        x = 10 + i * (width + gap)
+        img[20:20 + height, x:x + width] = 0
+    return img
+
+
+@pytest.mark.parametrize("gap", [4, 5, 6, 8, 12])
+def test_find_boxes_keeps_close_letters_apart(gap):
+    boxes = find_boxes(letter_row(gap))
+    assert len(boxes) == 12
+    assert boxes[:, 0].tolist() == [10 + i * (30 + gap) for i in range(12)]
+    assert (boxes[:, 2:] == (30, 40)).all()
+
+
+def test_find_boxes_bridges_one_pixel_breaks():
+    img = letter_row(12)
+    # A hairline break through the first letter, which the close joins up
+    img[40, 10:40] = 255
+    assert len(find_boxes(img)) == 12
+
+
+def test_find_boxes_reading_order_with_uneven_rows():
+    img = np.full((200, 200), 255, dtype=np.uint8)
+    for x, y in [(120, 30), (10, 20), (60, 25), (10, 120), (60, 110)]:
+        img[y:y + 40, x:x + 30] = 0
+    boxes = find_boxes(img)
+    assert boxes[:, :2].tolist() == [[10, 20], [60, 25], [120, 30], [10, 120], [60, 110]]
+
+
+def test_load_segments_survives_unwritable_sidecar(tmp_path, monkeypatch):
+    path = str(tmp_path / "sample.png")
+    cv2.imwrite(path, letter_row(6))
+
+    def read_only(*args, **kwargs):
+        raise PermissionError("read-only file system")
+
+    monkeypatch.setattr(handwriting_renderer, "_segments", handwriting_renderer.OrderedDict())
+    monkeypatch.setattr(np, "savez_compressed", read_only)
+    boxes, crops = load_segments(path)
+    assert len(boxes) == 12 and len(crops) == 12
+    assert os.listdir(tmp_path) == ["sample.png"]
+
+
+def test_segment_cache_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(handwriting_renderer, "_segments", handwriting_renderer.OrderedDict())
+    monkeypatch.setattr(handwriting_renderer, "MAX_SEGMENTS", 2)
+    for gap in (5, 6, 7):
+        path = str(tmp_path / f"sample{gap}.png")
+        cv2.imwrite(path, letter_row(gap))
+        load_segments(path)
+    assert len(handwriting_renderer._segments) == 2
+
+
+def test_long_words_split_into_pieces_that_fit():
+    widths = {"A": 20, "B": 35}
+    word = "AB" * 500
+    pieces = handwriting_renderer._split_word(word, widths, 10, 300)
+    assert "".join(pieces) == word
+    for piece in pieces:
+        width = sum(widths[char] for char in piece) + 10 * (len(piece) - 1)
+        assert width <= 300
+        # The next letter would not have fitted
+        assert width + 10 + widths["A"] > 300
+
+
+@pytest.mark.parametrize("page_width, page_height", [(1200, None), (30, None), (1200, 30), (10, 10)])
+def test_layout_clips_letters_bigger_than_the_page(page_width, page_height):
+    characters = {"A": np.full((40, 1300), 255, dtype=np.uint8), "B": np.full((40, 20), 255, dtype=np.uint8)}
+    pages = handwriting_renderer.layout_handwriting(characters, "A B AB", page_width, page_height)
+    assert all(page.shape[1] == page_width for page in pages)
+    assert (pages[0] == 0).any() or page_width <= 20
+
+
+def test_fallback_marks_keep_their_height_above_the_baseline():
+    characters = {"A": np.full((40, 20), 255, dtype=np.uint8),
+                  "'": np.full((10, 4), 255, dtype=np.uint8),
+                  ",": np.full((10, 4), 255, dtype=np.uint8)}
+    rises = {"'": 28, ",": -6}
+    page = handwriting_renderer.layout_handwriting(characters, "A' A,", margin=0, line_height=0, rises=rises)[0]
+
+    def rows(x):
+        ink = np.flatnonzero(page[:, x] == 0)
+        return ink[0], ink[-1] + 1
+
+    baseline = rows(0)[1]
+    assert rows(30) == (baseline - 38, baseline - 28)
+    assert rows(89) == (baseline - 4, baseline + 6)
@@ -0,0 +1,23 @@
+import pytest
+
+from utils.font_registry import get_font
+from utils.layout import layout_text
+
+FONT = "master_ttf/MyHandwriting.ttf"
+
+
+@pytest.fixture(scope="module")
+def font():
+    return get_font(FONT)
+
+
+def test_blank_lines_start_new_pages(font):
+    pages = layout_text(font, "\n" * 200 + "hello", 20, 595, 842, margin=56)
+    assert len(pages) > 1
+    (run,) = [run for page in pages for run in page.runs]
+    assert run.y // 64 < 842 - 56
+
+
+def test_every_line_stays_above_the_bottom_margin(font):
+    pages = layout_text(font, "a\n\n\nb " * 300, 20, 595, 842, margin=56)
+    assert all(run.y // 64 < 842 - 56 for page in pages for run in page.runs)
@@ -0,0 +1,45 @@
+import pytest
+
+from utils.font_registry import get_font
+from utils.font_stack import get_font_stack
+from utils.shaping import ShapingCache, shape
+
+FONT = "master_ttf/MyHandwriting.ttf"
+
+SAMPLES = [
+    "hello world",
+    "aabbbccdeeefghi sasasa",
+    "  leading and trailing  ",
+    "line one\nline two\n\nline\tfour",
+    "Digits 123, punctuation! and CAPS mixed in",
+    "the the the the quick brown fox the the",
+    "café naïve 日本 ab",
+    "",
+]
+
+
+@pytest.fixture(scope="module")
+def cache():
+    return ShapingCache()
+
+
+@pytest.fixture(scope="module", params=["font", "stack"])
+def font(request):
+    font = get_font(FONT)
+    return font if request.param == "font" else get_font_stack(font.path)
+
+
+@pytest.mark.parametrize("size", [40, 48, 128])
+@pytest.mark.parametrize("text", SAMPLES)
+def test_cached_word_shaping_matches_full_shaping(font, cache, text, size):
+    # Twice, so the second pass is served from the word cache
+    assert cache.shape(font, text, size) == shape(font, text, size)
+    assert cache.shape(font, text, size) == shape(font, text, size)
+
+
+def test_stack_falls_back_for_missing_characters():
+    stack = get_font_stack(FONT)
+    if len(stack.fonts) < 2:
+        pytest.skip("no fallback font installed")
+    glyphs = ShapingCache().shape(stack, "ab 日本 é", 48)
+    assert {g.font for g in glyphs} - {0}
@@ -0,0 +1,241 @@
+import math
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+
+class Rejected(Exception):
+    """
+    A request turned away before doing the work: 413 for a request that is
+    too big to ever run, 429 for a client with too much in flight and 503
+    when the pool is saturated. retry_after is in seconds, or None.
+    """
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+def render_cost(chars, size, base_size=48):
+    # Work grows with the number of glyphs and the area of each one
+    return chars * (size / base_size) ** 2
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class RenderPool:
+    """
+    A fixed number of worker threads behind a bounded queue. submit() refuses
+    work straight away once max_queue jobs are waiting instead of letting the
+    backlog, and everyone's latency, grow without limit.
+    """
+
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        # Recent queue waits and run times in seconds
+        self.waits = deque(maxlen=512)
+        self.service = deque(maxlen=512)
+
+    def retry_after(self):
+        # Time for the current backlog to drain at the recent pace
+        with self._lock:
+            backlog = self.queued + self.running
+            service = sum(self.service) / len(self.service) if self.service else 1.0
+        return max(1, math.ceil(backlog / self.workers * service))
+
+    def submit(self, fn):
+        with self._lock:
+            full = self.queued >= self.max_queue
+            if full:
+                self.rejected += 1
+            else:
+                self.queued += 1
+        if full:
+            raise Rejected(503, "Server busy, try again shortly.", self.retry_after())
+        return self.executor.submit(self._run, fn, time.perf_counter())
+
+    def _run(self, fn, enqueued):
+        started = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.waits.append(started - enqueued)
+        try:
+            return fn()
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+                self.service.append(time.perf_counter() - started)
+
+    def stats(self):
+        with self._lock:
+            waits, service = list(self.waits), list(self.service)
+            stats = {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
+        stats.update(
+            wait_p50=_percentile(waits, 0.5),
+            wait_p99=_percentile(waits, 0.99),
+            service_p50=_percentile(service, 0.5),
+            service_p99=_percentile(service, 0.99),
+        )
+        return stats
+
+
+class AdmissionControl:
+    """
+    Decides whether a render runs, and runs it on a bounded pool off the
+    request thread. Requests costing heavy_cost or more (see render_cost) get
+    their own small pool, so one pasted book can only hold up other books and
+    normal requests keep their latency.
+    """
+
+    def __init__(self, workers=2, max_queue=16, heavy_workers=1, heavy_queue=2, heavy_cost=5000,
+                 max_chars=100_000, max_cost=50_000, max_per_client=4, max_wait=15.0):
+        self.light = RenderPool("render", workers, max_queue)
+        self.heavy = RenderPool("render-heavy", heavy_workers, heavy_queue)
+        self.heavy_cost = heavy_cost
+        self.max_chars = max_chars
+        self.max_cost = max_cost
+        self.max_per_client = max_per_client
+        self.max_wait = max_wait
+        self._clients = Counter()
+        self._lock = threading.Lock()
+
+    def check(self, text, cost, max_cost=None):
+        """
+        Raise Rejected(413) for a request over the size or cost limits.
+        """
+        if len(text) > self.max_chars:
+            raise Rejected(413, f"Text is too long ({len(text)} characters, the limit is {self.max_chars}).")
+        max_cost = self.max_cost if max_cost is None else max_cost
+        if cost > max_cost:
+            raise Rejected(413, "Text is too long to render at this size; try a smaller size or less text.")
+
+    def _pool(self, cost):
+        return self.heavy if cost >= self.heavy_cost else self.light
+
+    def _release(self, client):
+        with self._lock:
+            self._clients[client] -= 1
+            if self._clients[client] <= 0:
+                del self._clients[client]
+
+    def submit(self, client, cost, fn):
+        """
+        Queue fn on the pool for its cost and return its future. Raises
+        Rejected if the client or the pool is full. The client's slot is held
+        until fn has actually finished, not just until someone stops waiting.
+        """
+        pool = self._pool(cost)
+        with self._lock:
+            busy = self._clients[client] >= self.max_per_client
+            if not busy:
+                self._clients[client] += 1
+        if busy:
+            raise Rejected(429, "Too many renders in progress, try again shortly.", pool.retry_after())
+
+        try:
+            future = pool.submit(fn)
+        except Rejected:
+            self._release(client)
+            raise
+        future.add_done_callback(lambda _: self._release(client))
+        return future
+
+    def run(self, client, cost, fn):
+        """
+        Run fn on the pool for its cost and wait for the result. Raises
+        Rejected if the client or the pool is full, or if the result takes
+        longer than max_wait (the work itself still finishes, and still
+        counts against the client).
+        """
+        future = self.submit(client, cost, fn)
+        try:
+            return future.result(timeout=self.max_wait)
+        except TimeoutError:
+            pool = self._pool(cost)
+            with pool._lock:
+                pool.timeouts += 1
+            raise Rejected(503, "Render is taking too long, try again shortly.", pool.retry_after())
+
+    def stream(self, client, cost, chunks):
+        """
+        Admit a streamed response. A worker of the pool for the cost and the
+        client's slot are held until the stream is finished or closed, so
+        documents rendered elsewhere (the batch process pool) still queue
+        behind, and are limited like, every other render.
+        """
+        started, finished = threading.Event(), threading.Event()
+
+        def hold():
+            started.set()
+            finished.wait()
+
+        self.submit(client, cost, hold)
+        if not started.wait(self.max_wait):
+            # Let the slot go as soon as it starts
+            finished.set()
+            pool = self._pool(cost)
+            with pool._lock:
+                pool.timeouts += 1
+            raise Rejected(503, "Server busy, try again shortly.", pool.retry_after())
+        return _HeldStream(chunks, finished.set)
+
+    def stats(self):
+        with self._lock:
+            clients = len(self._clients)
+        return {"clients": clients, "light": self.light.stats(), "heavy": self.heavy.stats()}
+
+
+class _HeldStream:
+    """
+    Iterates chunks and calls release once they run out or the response is
+    closed, whichever comes first.
+    """
+
+    def __init__(self, chunks, release):
+        self.chunks = iter(chunks)
+        self.release = release
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.chunks)
+        except BaseException:
+            self.release()
+            raise
+
+    def close(self):
+        try:
+            close = getattr(self.chunks, "close", None)
+            if close:
+                close()
+        finally:
+            self.release()
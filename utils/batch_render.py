@@ -0,0 +1,251 @@
+import io
+import json
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils.encode import encode_image, pack_page, TiffWriter
+from utils.font_stack import get_font_stack, DEFAULT_FALLBACKS
+from utils.glyph_atlas import get_atlas
+from utils.jitter_atlas import get_jitter_atlas
+from utils.layout import layout_text
+from utils.paper import paper_background
+from utils.pdf_export import PdfExporter, ImagePdfExporter, A4_POINTS
+from utils.raster import render_page
+
+# Earliest date a zip entry can hold, used for every page of a paged zip
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Per-process state, set up once by _init_worker
+_font_path = None
+_fallbacks = ()
+_sizes = ()
+
+
+def _init_worker(font_path, sizes, fallbacks=()):
+    """
+    Load the fonts and map the shared glyph atlas before the first item arrives.
+    """
+    global _font_path, _fallbacks, _sizes
+    _font_path = font_path
+    _fallbacks = fallbacks
+    _sizes = sizes
+    get_atlas(_fonts().primary, sizes)
+
+
+def _fonts():
+    return get_font_stack(_font_path, _fallbacks)
+
+
+def _render_png(text, size, page_width):
+    font = _fonts()
+    pages = layout_text(font, text, size, page_width=page_width, margin=20)
+    return encode_image(render_page(pages[0], font, size, get_atlas(font.primary, _sizes)))[0]
+
+
+def _render_page_image(page, size, fmt, depth, paper=None, dpi=72, seed=None):
+    # PNG for a zip entry, otherwise deflated rows for a TIFF strip or PDF image.
+    # Each worker draws the paper once and copies it under every page.
+    font = _fonts()
+    atlas = get_atlas(font.primary, _sizes)
+    background = paper_background(paper, page.width, page.height, dpi) if paper else None
+    jitter = get_jitter_atlas(font.primary, _sizes, fallback=atlas) if seed is not None else None
+    canvas = render_page(page, font, size, atlas, background=background, jitter=jitter, seed=seed or 0)
+    if fmt == "zip":
+        return encode_image(canvas, "png", depth)[0]
+    return pack_page(canvas, depth)
+
+
+def _layout_pdf(text, size):
+    return layout_text(_fonts(), text, size, *A4_POINTS, margin=56)
+
+
+class _ChunkStream(io.RawIOBase):
+    """
+    Write-only stream that keeps what was written until drained, so a zip or
+    PDF can be sent to the client piece by piece.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _entry_name(name, used):
+    # Names become zip entry names: keep a plain file name, unique in the batch
+    base = re.sub(r"[^\w.-]", "_", name.replace("\\", "/").rsplit("/", 1)[-1])
+    base = base.lstrip(".")[:100] or "item"
+    name, n = base, 2
+    while name in used:
+        name, n = f"{base}-{n}", n + 1
+    used.add(name)
+    return name
+
+
+def parse_items(data, is_json):
+    """
+    Accept a JSON list (or {"texts": [...]}) of strings or {"name", "text"}
+    objects, or plain text with one item per line. Returns (name, text) pairs
+    with names that are safe, unique file names. Raises ValueError for
+    anything else.
+    """
+    if is_json:
+        if isinstance(data, (bytes, str)):
+            data = json.loads(data)
+        if isinstance(data, dict):
+            data = data.get("texts", [])
+        if not isinstance(data, list):
+            raise ValueError("Expected a list of texts.")
+        items = []
+        for i, item in enumerate(data):
+            name = f"{i + 1:04d}"
+            if isinstance(item, dict):
+                name, item = item.get("name") or name, item.get("text", "")
+            if not isinstance(name, str) or not isinstance(item, str):
+                raise ValueError(f"Item {i + 1}: names and texts must be strings.")
+            items.append((name, item))
+    else:
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        lines = [line.strip() for line in data.splitlines()]
+        items = [(f"{i + 1:04d}", line) for i, line in enumerate(line for line in lines if line)]
+
+    used = set()
+    return [(_entry_name(name, used), text) for name, text in items]
+
+
+def _cancel(futures):
+    # A client that went away leaves its queued items unrendered
+    for future in futures:
+        future.cancel()
+
+
+class BatchRenderer:
+    """
+    Fans texts out over a process pool whose workers already hold the font
+    and the memory-mapped glyph atlas.
+    """
+
+    def __init__(self, font_path, workers=None, size=48, page_width=1200, pdf_size=20,
+                 fallbacks=DEFAULT_FALLBACKS):
+        self.font_path = font_path
+        self.fallbacks = fallbacks
+        self.size = size
+        self.page_width = page_width
+        self.pdf_size = pdf_size
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count(),
+            initializer=_init_worker,
+            initargs=(font_path, (size,), fallbacks),
+        )
+
+    def iter_zip(self, items):
+        """
+        Yield a zip of PNGs chunk by chunk, adding each item as soon as it is done.
+        """
+        futures = {
+            self.executor.submit(_render_png, text, self.size, self.page_width): name
+            for name, text in items
+        }
+        stream = _ChunkStream()
+        try:
+            with zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED) as archive:
+                for future in as_completed(futures):
+                    # PNG is already compressed, deflating it again is wasted time
+                    archive.writestr(f"{futures[future]}.png", future.result())
+                    yield stream.drain()
+            yield stream.drain()
+        finally:
+            _cancel(futures)
+
+    def iter_pdf(self, items):
+        """
+        Yield one PDF holding every item, each starting on a new page. Items are
+        laid out in parallel and written in order as they become available.
+        """
+        futures = [self.executor.submit(_layout_pdf, text, self.pdf_size) for _, text in items]
+        stream = _ChunkStream()
+        try:
+            exporter = PdfExporter(stream, get_font_stack(self.font_path, self.fallbacks), self.pdf_size)
+            for future in futures:
+                for page in future.result():
+                    exporter.add_page(page)
+                yield stream.drain()
+            exporter.close()
+            yield stream.drain()
+        finally:
+            _cancel(futures)
+
+    def iter_pages(self, pages, size, fmt="pdf", depth="gray", dpi=72, paper=None, seed=None):
+        """
+        Yield one document (pdf, tiff or zip of PNGs) for pages that are already
+        laid out. Pages are rasterized in parallel and written in page order,
+        on the paper style `paper` if one is given. With a seed the glyphs are
+        drawn from the jitter atlas.
+        """
+        futures = [self.executor.submit(_render_page_image, page, size, fmt, depth, paper, dpi, seed)
+                   for page in pages]
+        stream = _ChunkStream()
+        try:
+            if fmt == "zip":
+                with zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED) as archive:
+                    for page, future in zip(pages, futures):
+                        # A fixed timestamp keeps the zip byte-identical between
+                        # requests, which its strong ETag relies on
+                        entry = zipfile.ZipInfo(f"page-{page.number + 1:04d}.png", date_time=ZIP_DATE_TIME)
+                        archive.writestr(entry, future.result())
+                        yield stream.drain()
+                yield stream.drain()
+                return
+
+            writer = TiffWriter(stream) if fmt == "tiff" else ImagePdfExporter(stream, dpi)
+            for page, future in zip(pages, futures):
+                writer.add_page(page.width, page.height, future.result(), depth)
+                yield stream.drain()
+            writer.close()
+            yield stream.drain()
+        finally:
+            _cancel(futures)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Render many texts in handwriting at once.")
+    parser.add_argument("input", help="JSON list of texts, or a text file with one item per line")
+    parser.add_argument("output", help="output .zip of PNGs or a single .pdf")
+    parser.add_argument("--font", default="master_ttf/MyHandwriting.ttf")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.input, "rb") as f:
+        raw = f.read()
+    items = parse_items(raw, args.input.endswith(".json"))
+
+    renderer = BatchRenderer(args.font, workers=args.workers)
+    chunks = renderer.iter_pdf(items) if args.output.endswith(".pdf") else renderer.iter_zip(items)
+    with open(args.output, "wb") as out:
+        for chunk in chunks:
+            out.write(chunk)
+    renderer.shutdown()
+    print(f"✅ Rendered {len(items)} items into {args.output}")
@@ -0,0 +1,45 @@
+import numpy as np
+from PIL import Image
+
+
+def new_canvas(width, height, mode="L", background=255):
+    """
+    Preallocated canvas as a uint8 array, (h, w) for L and (h, w, 3) for RGB.
+    Ink is black on white, so single-channel L is the default.
+    """
+    shape = (height, width, 3) if mode == "RGB" else (height, width)
+    return np.full(shape, background, dtype=np.uint8)
+
+
+def to_image(canvas):
+    return Image.fromarray(canvas, "RGB" if canvas.ndim == 3 else "L")
+
+
+def composite(canvas, coverage, x, y, ink=0, mode="alpha"):
+    """
+    Blend an anti-aliased coverage bitmap onto the canvas at (x, y) in one array
+    operation. The bitmap is clipped to the canvas once, up front.
+
+    mode="alpha" blends ink over whatever is underneath.
+    mode="min" keeps the darker of canvas and glyph, so overlapping dark strokes
+    never lighten each other (only meaningful for dark ink on a light canvas).
+    """
+    h, w = coverage.shape
+    canvas_h, canvas_w = canvas.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, canvas_w), min(y + h, canvas_h)
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    cov = coverage[y0 - y:y1 - y, x0 - x:x1 - x].astype(np.uint16)
+    dst = canvas[y0:y1, x0:x1]
+    if canvas.ndim == 3:
+        cov = cov[..., None]
+    ink = np.asarray(ink, dtype=np.uint16)
+
+    if mode == "min":
+        # Glyph drawn over white, then darken
+        glyph = 255 - (cov * (255 - ink) + 127) // 255
+        np.minimum(dst, glyph.astype(np.uint8), out=dst)
+    else:
+        dst[...] = (dst * (255 - cov) + ink * cov + 127) // 255
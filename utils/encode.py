@@ -0,0 +1,186 @@
+import io
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+MIMETYPES = {"png": "image/png", "tiff": "image/tiff"}
+DEPTHS = ("gray", "palette", "1bit")
+
+# zlib effort for PNG: level 1 is several times faster than 9 for a few
+# percent more bytes on black-on-white text
+PNG_LEVELS = {"fast": 1, "balanced": 6, "small": 9}
+
+# 16 evenly spaced greys, enough for anti-aliased ink at 4 bits per pixel
+GRAY_PALETTE = [v * 17 for v in range(16) for _ in range(3)]
+
+
+def to_depth(canvas, depth="gray"):
+    """
+    Single-channel canvas to a PIL image at the requested bit depth:
+    "gray" is 8-bit L, "palette" is 16 greys at 4 bits, "1bit" is thresholded.
+    """
+    if canvas.ndim == 3:
+        canvas = canvas.min(axis=2)
+    if depth == "1bit":
+        return Image.fromarray(canvas >= 128)
+    if depth == "palette":
+        image = Image.fromarray(canvas >> 4)
+        image.putpalette(GRAY_PALETTE)
+        return image
+    return Image.fromarray(canvas)
+
+
+def encode_image(canvas, fmt="png", depth="gray", level="fast"):
+    """
+    Encode a canvas in memory. Returns (bytes, mimetype).
+    """
+    image = to_depth(canvas, depth)
+    output = io.BytesIO()
+    if fmt == "tiff":
+        # Group 4 fax coding is both the fastest and smallest for 1-bit pages
+        compression = "group4" if depth == "1bit" else "tiff_deflate"
+        image.save(output, "TIFF", compression=compression)
+    else:
+        options = {"compress_level": PNG_LEVELS.get(level, 1)}
+        if depth == "palette":
+            options["bits"] = 4
+        image.save(output, "PNG", **options)
+    return output.getvalue(), MIMETYPES.get(fmt, "image/png")
+
+
+def _png_chunk(kind, data):
+    body = kind + data
+    return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+
+def _pack_rows(band, depth):
+    if depth == "1bit":
+        return np.packbits(band >= 128, axis=1)
+    return band
+
+
+def write_png_bands(fp, width, height, bands, depth="gray", level="fast"):
+    """
+    Stream horizontal bands of a single-channel canvas into a PNG, one IDAT
+    chunk per band, so only one band is ever held in memory. fp only needs
+    write(), it does not have to be seekable.
+    """
+    bits = 1 if depth == "1bit" else 8
+    fp.write(b"\x89PNG\r\n\x1a\n")
+    fp.write(_png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, bits, 0, 0, 0, 0)))
+
+    compressor = zlib.compressobj(PNG_LEVELS.get(level, 1))
+    for band in bands:
+        rows = _pack_rows(band, depth)
+        # Filter type 0 (none) in front of every row
+        raw = np.zeros((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        raw[:, 1:] = rows
+        data = compressor.compress(raw.tobytes())
+        if data:
+            fp.write(_png_chunk(b"IDAT", data))
+    fp.write(_png_chunk(b"IDAT", compressor.flush()))
+    fp.write(_png_chunk(b"IEND", b""))
+
+
+def pack_page(canvas, depth="gray"):
+    """
+    One page as zlib-compressed packed rows, ready to drop into a TIFF strip
+    or a PDF image without decoding.
+    """
+    return zlib.compress(_pack_rows(canvas, depth).tobytes(), 6)
+
+
+def _tiff_ifd(width, height, bits, rows_per_strip, offsets, counts, tables_at, next_ifd=0):
+    """
+    Image directory for one page. With several strips the offset and count
+    tables are stored out of line at tables_at, which the caller writes.
+    """
+    single = len(offsets) == 1
+    tags = [
+        (256, 4, 1, width),
+        (257, 4, 1, height),
+        (258, 3, 1, bits),
+        (259, 3, 1, 8),  # Adobe deflate
+        (262, 3, 1, 1),  # BlackIsZero
+        (273, 4, len(offsets), offsets[0] if single else tables_at),
+        (277, 3, 1, 1),
+        (278, 4, 1, rows_per_strip),
+        (279, 4, len(counts), counts[0] if single else tables_at + 4 * len(offsets)),
+    ]
+    ifd = struct.pack("<H", len(tags))
+    for tag, kind, count, value in tags:
+        ifd += struct.pack("<HHII", tag, kind, count, value)
+    return ifd + struct.pack("<I", next_ifd)
+
+
+def write_tiff_bands(fp, width, height, bands, depth="gray", band_height=256):
+    """
+    Stream horizontal bands into a TIFF with one deflated strip per band.
+    Every band except the last must be band_height rows. The directory goes
+    at the end, so fp must be seekable to patch its offset into the header.
+    """
+    bits = 1 if depth == "1bit" else 8
+    start = fp.tell()
+    fp.write(b"II*\x00\x00\x00\x00\x00")
+
+    offsets, counts = [], []
+    for band in bands:
+        data = pack_page(band, depth)
+        offsets.append(fp.tell() - start)
+        counts.append(len(data))
+        fp.write(data)
+
+    # Strip tables, word aligned, then the directory itself
+    if (fp.tell() - start) % 2:
+        fp.write(b"\x00")
+    tables_at = fp.tell() - start
+    fp.write(struct.pack(f"<{len(offsets)}I", *offsets))
+    fp.write(struct.pack(f"<{len(counts)}I", *counts))
+    ifd_at = fp.tell() - start
+    fp.write(_tiff_ifd(width, height, bits, band_height, offsets, counts, tables_at))
+
+    end = fp.tell()
+    fp.seek(start + 4)
+    fp.write(struct.pack("<I", ifd_at))
+    fp.seek(end)
+
+
+class TiffWriter:
+    """
+    Multi-page TIFF written strictly front to back, so fp can be a response
+    stream. Pages arrive already packed (see pack_page) as a single strip.
+    One page is held back until the next arrives, because a directory has to
+    say whether another page follows it.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.position = 8
+        self.pending = None
+        # The first directory always starts right after the header
+        fp.write(b"II*\x00" + struct.pack("<I", 8))
+
+    def _write(self, page, last):
+        width, height, data, depth = page
+        bits = 1 if depth == "1bit" else 8
+        ifd_size = 2 + 9 * 12 + 4
+        data_at = self.position + ifd_size
+        end = data_at + len(data) + len(data) % 2
+        ifd = _tiff_ifd(width, height, bits, height, [data_at], [len(data)], 0, 0 if last else end)
+        self.fp.write(ifd)
+        self.fp.write(data)
+        if len(data) % 2:
+            self.fp.write(b"\x00")
+        self.position = end
+
+    def add_page(self, width, height, data, depth="gray"):
+        if self.pending:
+            self._write(self.pending, last=False)
+        self.pending = (width, height, data, depth)
+
+    def close(self):
+        if self.pending:
+            self._write(self.pending, last=True)
+            self.pending = None
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import threading
+
+import freetype
+import uharfbuzz as hb
+
+
+class _SharedBytes:
+    """
+    Minimal stream for freetype.Face, which takes a font from memory by
+    calling .read() and passing the result to FT_New_Memory_Face. Returning
+    the bytes object itself guarantees every face uses the one buffer; ctypes
+    hands FreeType a pointer into it.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class LoadedFont:
+    """
+    One version of a font file. The raw bytes are read once and shared by
+    HarfBuzz and FreeType without copying; shaped fonts and faces are built
+    lazily per pixel size.
+    """
+
+    def __init__(self, path, data, stamp):
+        self.path = path
+        self.data = data
+        self.stamp = stamp
+        self.hash = hashlib.sha1(data).hexdigest()
+        self.hb_face = hb.Face(hb.Blob(data))
+        self._hb_fonts = {}
+        self._lock = threading.Lock()
+        # FreeType faces keep per-glyph state, so each thread gets its own
+        self._local = threading.local()
+
+    def hb_font(self, size):
+        """
+        HarfBuzz font scaled so positions come out in 26.6 pixels at `size`.
+        """
+        font = self._hb_fonts.get(size)
+        if font is None:
+            with self._lock:
+                font = self._hb_fonts.get(size)
+                if font is None:
+                    font = hb.Font(self.hb_face)
+                    font.scale = (size * 64, size * 64)
+                    self._hb_fonts[size] = font
+        return font
+
+    def ft_face(self, size):
+        faces = getattr(self._local, "faces", None)
+        if faces is None:
+            faces = self._local.faces = {}
+        face = faces.get(size)
+        if face is None:
+            # Every face reads from the registry's bytes, not a copy of them
+            face = freetype.Face(_SharedBytes(self.data))
+            face.set_char_size(size * 64)
+            faces[size] = face
+        return face
+
+
+class FontRegistry:
+    """
+    Process-wide cache of loaded fonts. A font is reloaded only when its file's
+    mtime or size changes and the new content hashes differently.
+    """
+
+    def __init__(self):
+        self._fonts = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        font = self._fonts.get(path)
+        if font is not None and font.stamp == stamp:
+            return font
+
+        with self._lock:
+            font = self._fonts.get(path)
+            if font is not None and font.stamp == stamp:
+                return font
+
+            with open(path, "rb") as f:
+                data = f.read()
+            if font is not None and font.hash == hashlib.sha1(data).hexdigest():
+                # Touched but unchanged, keep the warm objects
+                font.stamp = stamp
+                return font
+
+            font = LoadedFont(path, data, stamp)
+            self._fonts[path] = font
+            return font
+
+    def clear(self):
+        with self._lock:
+            self._fonts.clear()
+
+
+registry = FontRegistry()
+
+
+def get_font(path):
+    return registry.get(path)
@@ -0,0 +1,92 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+from utils.font_registry import get_font
+
+# Tried in order for anything the handwriting font doesn't cover; only the
+# ones present on this machine are used
+DEFAULT_FALLBACKS = (
+    "master_ttf/Fallback.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+)
+
+UNICODE_SIZE = 0x110000
+
+
+def build_coverage(fonts):
+    """
+    Index of the first font that has each codepoint, as one uint8 per
+    codepoint. Codepoints no font covers map to the first font (.notdef).
+    """
+    coverage = np.zeros(UNICODE_SIZE, dtype=np.uint8)
+    # Later fonts first, so earlier fonts overwrite them
+    for index in range(len(fonts) - 1, 0, -1):
+        codepoints = np.fromiter(fonts[index].hb_face.unicodes, dtype=np.uint32)
+        coverage[codepoints] = index
+    codepoints = np.fromiter(fonts[0].hb_face.unicodes, dtype=np.uint32)
+    coverage[codepoints] = 0
+    return coverage
+
+
+class FontStack:
+    """
+    The handwriting font followed by fallbacks. Line metrics come from the
+    first font; every glyph remembers which font it was shaped with.
+    """
+
+    def __init__(self, fonts):
+        self.fonts = list(fonts)
+        self.primary = self.fonts[0]
+        self.path = self.primary.path
+        self.hash = hashlib.sha1("".join(font.hash for font in self.fonts).encode("ascii")).hexdigest()
+        self.coverage = build_coverage(self.fonts)
+
+    def hb_font(self, size):
+        return self.primary.hb_font(size)
+
+    def ft_face(self, size):
+        return self.primary.ft_face(size)
+
+    def split(self, text):
+        """
+        Split text into (start, end, font index) runs in one pass over the
+        codepoints.
+        """
+        if not text:
+            return []
+        indices = self.coverage[np.frombuffer(text.encode("utf-32-le"), dtype="<u4")]
+        if len(self.fonts) == 1 or not indices.any():
+            return [(0, len(text), 0)]
+        bounds = [0, *(np.flatnonzero(indices[1:] != indices[:-1]) + 1).tolist(), len(text)]
+        return [(start, end, int(indices[start])) for start, end in zip(bounds, bounds[1:])]
+
+
+def fonts_of(font):
+    # The fonts glyph font indices refer to, for a stack or a single font
+    return font.fonts if isinstance(font, FontStack) else [font]
+
+
+_stacks = {}
+_lock = threading.Lock()
+
+
+def get_font_stack(path, fallbacks=DEFAULT_FALLBACKS):
+    """
+    Stack for the font at path plus whichever fallbacks exist, rebuilt when
+    any of the font files changes.
+    """
+    paths = (path, *(p for p in fallbacks if p != path and os.path.exists(p)))
+    fonts = [get_font(p) for p in paths]
+    stack = _stacks.get(paths)
+    if stack is None or any(a is not b for a, b in zip(stack.fonts, fonts)):
+        with _lock:
+            stack = _stacks.get(paths)
+            if stack is None or any(a is not b for a, b in zip(stack.fonts, fonts)):
+                stack = FontStack(fonts)
+                _stacks[paths] = stack
+    return stack
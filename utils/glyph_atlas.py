@@ -0,0 +1,218 @@
+import os
+import re
+import threading
+
+import numpy as np
+
+from utils.glyph_cache import CachedGlyph, GlyphCache, rasterize_glyph, SUBPIXEL_PHASES
+
+ATLAS_WIDTH = 2048
+
+# Index table columns: x, y, w, h, left, top, advance_x, advance_y
+
+
+def pack_glyphs(glyphs, width=ATLAS_WIDTH):
+    """
+    Shelf-pack bitmaps into rows of a fixed-width atlas, tallest first.
+    Returns the (x, y) of each bitmap and the total height.
+    """
+    order = sorted(range(len(glyphs)), key=lambda i: -glyphs[i].shape[0])
+    positions = [(0, 0)] * len(glyphs)
+    x = y = shelf_h = 0
+    for i in order:
+        h, w = glyphs[i].shape
+        if w == 0 or h == 0:
+            continue
+        if x + w > width:
+            x, y = 0, y + shelf_h
+            shelf_h = 0
+        positions[i] = (x, y)
+        x += w
+        shelf_h = max(shelf_h, h)
+    return positions, y + shelf_h
+
+
+def build_atlas(font, sizes, phases=SUBPIXEL_PHASES):
+    """
+    Rasterize every glyph of the font at each size and subpixel phase into
+    one uint8 buffer plus an index table of shape
+    (len(sizes), phases, num_glyphs, 8).
+    """
+    bitmaps, metrics = [], []
+    for size in sizes:
+        face = font.ft_face(size)
+        for phase in range(phases):
+            for gid in range(face.num_glyphs):
+                glyph = rasterize_glyph(face, gid, phase, phases)
+                bitmaps.append(glyph.bitmap)
+                metrics.append((glyph.left, glyph.top, glyph.advance_x, glyph.advance_y))
+
+    positions, height = pack_glyphs(bitmaps)
+    pixels = np.zeros((max(height, 1), ATLAS_WIDTH), dtype=np.uint8)
+    index = np.zeros((len(bitmaps), 8), dtype=np.int32)
+    for i, (bitmap, (x, y), m) in enumerate(zip(bitmaps, positions, metrics)):
+        h, w = bitmap.shape
+        pixels[y:y + h, x:x + w] = bitmap
+        index[i] = (x, y, w, h) + m
+
+    return pixels, index.reshape(len(sizes), phases, -1, 8)
+
+
+class GlyphAtlas:
+    """
+    Read-only packed glyphs for a fixed set of sizes. Bitmaps handed out are
+    views into the atlas buffer, so when it is memory-mapped every process
+    shares the same pages. Sizes or fonts the atlas doesn't hold fall back to
+    an ordinary GlyphCache.
+
+    get() has the same signature as GlyphCache.get so either can be passed to
+    the renderers.
+    """
+
+    def __init__(self, font_hash, sizes, pixels, index, fallback=None):
+        self.font_hash = font_hash
+        self.sizes = {int(size): i for i, size in enumerate(sizes)}
+        self.phases = index.shape[1]
+        self.pixels = pixels
+        self.index = index
+        self.fallback = fallback or GlyphCache()
+        self._glyphs = {}
+
+    def get(self, face, font_hash, size, glyph_id, phase=0):
+        glyph = self._glyphs.get((size, glyph_id, phase))
+        if glyph is not None and font_hash == self.font_hash:
+            return glyph
+
+        slot = self.sizes.get(size)
+        if (font_hash != self.font_hash or slot is None or glyph_id >= self.index.shape[2]
+                or phase >= self.phases):
+            return self.fallback.get(face, font_hash, size, glyph_id, phase)
+
+        x, y, w, h, left, top, advance_x, advance_y = self.index[slot, phase, glyph_id].tolist()
+        glyph = CachedGlyph(self.pixels[y:y + h, x:x + w], left, top, advance_x, advance_y)
+        self._glyphs[(size, glyph_id, phase)] = glyph
+        return glyph
+
+    def nbytes(self):
+        return self.pixels.nbytes + self.index.nbytes
+
+
+def atlas_base(font, directory=None, kind="atlas", sizes=()):
+    """
+    Path, without extension, of one atlas of this font version. Every set of
+    sizes gets its own files, so workers asking for different sizes don't
+    overwrite each other's atlas.
+    """
+    directory = directory or os.path.dirname(os.path.abspath(font.path))
+    stem = os.path.splitext(os.path.basename(font.path))[0]
+    tag = "".join(f"-{size}" for size in sizes)
+    return os.path.join(directory, f"{stem}.{font.hash[:12]}.{kind}{tag}")
+
+
+def save_atlas(base, pixels, **arrays):
+    """
+    Save the pixel buffer (.npy, so it can be memory-mapped) under a new
+    generation name, then the small index arrays (.npz) naming that
+    generation. Both go to temporary names first, and the pixels are in
+    place before the index that points at them, so other workers never map
+    half a file or pair an index with another build's pixels. The pixel file
+    of the generation replaced is deleted; workers that mapped it keep their
+    mapping. Returns the memory-mapped pixels.
+    """
+    generation = os.urandom(6).hex()
+    pixels_path = f"{base}.{generation}.npy"
+    index_path = f"{base}-index.npz"
+    tmp_pixels = f"{pixels_path}.{os.getpid()}.tmp.npy"
+    tmp_index = f"{base}-index.{os.getpid()}.tmp.npz"
+    np.save(tmp_pixels, pixels)
+    os.replace(tmp_pixels, pixels_path)
+    # Mapped before it is published, so a newer build can't delete it first
+    mapped = np.load(pixels_path, mmap_mode="r")
+
+    previous = None
+    try:
+        with np.load(index_path) as saved:
+            previous = saved["generation"].item()
+    except (OSError, KeyError, ValueError):
+        pass
+    np.savez(tmp_index, generation=np.array(generation), **arrays)
+    os.replace(tmp_index, index_path)
+    if previous and previous != generation:
+        _remove(f"{base}.{previous}.npy")
+    return mapped
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def prune_atlases(font, directory=None):
+    """
+    Delete the atlases of earlier versions of the font, once a build for the
+    current one exists.
+    """
+    directory = directory or os.path.dirname(os.path.abspath(font.path))
+    stem = os.path.splitext(os.path.basename(font.path))[0]
+    pattern = re.compile(re.escape(stem) + r"\.([0-9a-f]{12})\.[\w-]*atlas[\w.-]*\.np[yz]")
+    for entry in os.scandir(directory):
+        match = pattern.fullmatch(entry.name)
+        if match and match.group(1) != font.hash[:12]:
+            _remove(entry.path)
+
+
+def load_atlas(base):
+    """
+    (memory-mapped pixels, dict of index arrays) of a saved atlas, or None if
+    there is no complete one.
+    """
+    try:
+        with np.load(f"{base}-index.npz") as saved:
+            arrays = dict(saved)
+        generation = arrays.pop("generation").item()
+        return np.load(f"{base}.{generation}.npy", mmap_mode="r"), arrays
+    except (FileNotFoundError, KeyError):
+        return None
+
+
+def load_or_build_atlas(font, sizes, directory=None, fallback=None, phases=SUBPIXEL_PHASES):
+    """
+    Memory-map the atlas for this font version, building and saving it next to
+    the font first if it doesn't exist yet.
+    """
+    sizes = tuple(sorted(set(sizes)))
+    base = atlas_base(font, directory, sizes=sizes)
+
+    saved = load_atlas(base)
+    if saved is not None:
+        pixels, arrays = saved
+        index = arrays["index"]
+        if tuple(arrays["sizes"].tolist()) == sizes and index.ndim == 4 and index.shape[1] == phases:
+            return GlyphAtlas(font.hash, sizes, pixels, index, fallback)
+
+    pixels, index = build_atlas(font, sizes, phases)
+    pixels = save_atlas(base, pixels, index=index, sizes=np.array(sizes))
+    prune_atlases(font, directory)
+    return GlyphAtlas(font.hash, sizes, pixels, index, fallback)
+
+
+_atlases = {}
+_lock = threading.Lock()
+
+
+def get_atlas(font, sizes, directory=None, fallback=None):
+    """
+    Atlas for the current version of the font, loaded once per process and
+    swapped out when the font file changes.
+    """
+    key = (font.path, tuple(sorted(set(sizes))), directory)
+    atlas = _atlases.get(key)
+    if atlas is None or atlas.font_hash != font.hash:
+        with _lock:
+            atlas = _atlases.get(key)
+            if atlas is None or atlas.font_hash != font.hash:
+                atlas = load_or_build_atlas(font, sizes, directory, fallback)
+                _atlases[key] = atlas
+    return atlas
@@ -0,0 +1,110 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+import freetype
+import numpy as np
+
+# Coverage bitmap ready to composite plus the metrics needed to place it
+CachedGlyph = namedtuple("CachedGlyph", ["bitmap", "left", "top", "advance_x", "advance_y"])
+
+# Horizontal positions are rounded to 1/SUBPIXEL_PHASES of a pixel, and each
+# glyph is rasterized once per phase it is drawn at
+SUBPIXEL_PHASES = 4
+
+_IDENTITY = freetype.Matrix(0x10000, 0, 0, 0x10000)
+
+
+def subpixel(x, phases=SUBPIXEL_PHASES):
+    """
+    Split a 26.6 x coordinate into (whole pixel, phase), rounded to the
+    nearest 1/phases of a pixel.
+    """
+    return divmod((x * phases + 32) // 64, phases)
+
+
+def rasterize_glyph(face, glyph_id, phase=0, phases=SUBPIXEL_PHASES):
+    """
+    Render one glyph with FreeType at the face's current size, shifted right
+    by phase/phases of a pixel.
+    """
+    if phase:
+        face.set_transform(_IDENTITY, freetype.Vector(phase * 64 // phases, 0))
+        try:
+            face.load_glyph(glyph_id, freetype.FT_LOAD_RENDER)
+        finally:
+            face.set_transform(_IDENTITY, freetype.Vector(0, 0))
+    else:
+        face.load_glyph(glyph_id, freetype.FT_LOAD_RENDER)
+    slot = face.glyph
+    bitmap = slot.bitmap
+
+    coverage = np.array(bitmap.buffer, dtype=np.uint8)
+    if bitmap.rows and bitmap.width:
+        coverage = coverage.reshape(bitmap.rows, bitmap.pitch)[:, :bitmap.width]
+    else:
+        coverage = coverage.reshape(bitmap.rows, bitmap.width)
+    return CachedGlyph(
+        bitmap=coverage,
+        left=slot.bitmap_left,
+        top=slot.bitmap_top,
+        advance_x=slot.advance.x,
+        advance_y=slot.advance.y,
+    )
+
+
+class GlyphCache:
+    """
+    Bounded LRU cache of rasterized glyphs keyed by (font hash, pixel size,
+    glyph id, subpixel phase). The face passed to get() must already be set
+    to the requested pixel size.
+
+    rasterize(face, size, glyph_id) produces a CachedGlyph on a miss; it
+    defaults to FreeType. Phases other than 0 always come from FreeType.
+    """
+
+    def __init__(self, max_glyphs=2048, rasterize=None):
+        self.max_glyphs = max_glyphs
+        self.rasterize = rasterize or (lambda face, size, glyph_id: rasterize_glyph(face, glyph_id))
+        self._glyphs = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, face, font_hash, size, glyph_id, phase=0):
+        key = (font_hash, size, glyph_id, phase)
+        with self._lock:
+            glyph = self._glyphs.get(key)
+            if glyph is not None:
+                self._glyphs.move_to_end(key)
+                self.hits += 1
+                return glyph
+            self.misses += 1
+
+        # Rasterize outside the lock, it is the slow part
+        if phase:
+            glyph = rasterize_glyph(face, glyph_id, phase)
+        else:
+            glyph = self.rasterize(face, size, glyph_id)
+
+        with self._lock:
+            self._glyphs[key] = glyph
+            self._glyphs.move_to_end(key)
+            while len(self._glyphs) > self.max_glyphs:
+                self._glyphs.popitem(last=False)
+                self.evictions += 1
+        return glyph
+
+    def clear(self):
+        with self._lock:
+            self._glyphs.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._glyphs),
+                "max_glyphs": self.max_glyphs,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -1,68 +1,335 @@
-from PIL import Image, ImageDraw
+from PIL import Image
 import cv2
+import hashlib
 import numpy as np
+import os
 import string
+import threading
+from collections import Counter, OrderedDict
 
-def segment_characters(image_path):
+from utils.font_stack import get_font_stack, DEFAULT_FALLBACKS
+from utils.glyph_cache import rasterize_glyph
+
+EXPECTED_CHARS = string.ascii_uppercase + string.digits
+# Bumped whenever find_boxes changes, so older sidecars are not reused
+SEGMENTS_VERSION = 2
+# Segmented samples kept in memory
+MAX_SEGMENTS = 16
+
+# Segmented samples by content hash, least recently used first: (boxes, crops)
+_segments = OrderedDict()
+_segments_lock = threading.Lock()
+
+def find_boxes(img):
     """
-    Detect characters from a full-page handwriting sample.
-    Assumes characters A-Z followed by 0-9 are written clearly (in any layout).
+    Bounding boxes (x, y, w, h) of the characters in a grayscale sample, in
+    reading order: rows top to bottom, then left to right.
     """
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
     _, thresh = cv2.threshold(img, 180, 255, cv2.THRESH_BINARY_INV)
 
     # Morphological operation to reduce noise
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3,3))
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
     thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
 
-    # Find contours of characters
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    # One labelling pass gives every component's box; label 0 is the background
+    _, _, stats, _ = cv2.connectedComponentsWithStats(thresh, connectivity=8)
+    boxes = stats[1:, :4].astype(np.int32)
+    if not len(boxes):
+        return boxes
+
+    # Sorted by top, a box starts a new row when it is more than a typical
+    # character height below the one before it
+    by_top = boxes[np.argsort(boxes[:, 1], kind="stable")]
+    gap = max(np.median(by_top[:, 3]), 1)
+    rows = np.concatenate(([0], np.cumsum(np.diff(by_top[:, 1]) > gap)))
+    return by_top[np.lexsort((by_top[:, 0], rows))]
 
-    bounding_boxes = [cv2.boundingRect(c) for c in contours]
-    
-    # Sort by rows then columns (top to bottom, then left to right)
-    def sort_key(bbox):
-        x, y, w, h = bbox
-        return (y // 20) * 10000 + x  # rough row separation by y // 20
+def _sidecar_path(image_path, digest):
+    stem = os.path.splitext(image_path)[0]
+    return f"{stem}.{digest[:12]}.v{SEGMENTS_VERSION}.segments.npz"
 
-    sorted_boxes = sorted(bounding_boxes, key=sort_key)
+def _save_sidecar(sidecar, boxes, pixels):
+    # Only a speed-up: a sample in a read-only directory is segmented each time
+    tmp = f"{sidecar}.{os.getpid()}.tmp.npz"
+    try:
+        np.savez_compressed(tmp, boxes=boxes, pixels=pixels)
+        os.replace(tmp, sidecar)
+    except OSError as e:
+        print(f"Warning: could not save segments to {sidecar}: {e}")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
 
-    expected_chars = string.ascii_uppercase + string.digits
-    if len(sorted_boxes) < len(expected_chars):
+def load_segments(image_path):
+    """
+    Boxes and white-on-black crops of the sample's characters. Cached by the
+    image's content hash in memory and in a .npz next to the image, so a
+    sample is only segmented once however often it is rendered from.
+    """
+    with open(image_path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha1(data).hexdigest()
+    with _segments_lock:
+        segments = _segments.get(digest)
+        if segments is not None:
+            _segments.move_to_end(digest)
+            return segments
+
+    sidecar = _sidecar_path(image_path, digest)
+    if os.path.exists(sidecar):
+        with np.load(sidecar) as saved:
+            boxes, pixels = saved["boxes"], saved["pixels"]
+    else:
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        boxes = find_boxes(img)[:len(EXPECTED_CHARS)].astype(np.int32)
+        # Crops are stored end to end in one flat array
+        pixels = np.concatenate([(255 - img[y:y+h, x:x+w]).ravel() for x, y, w, h in boxes]
+                                or [np.zeros(0, dtype=np.uint8)])
+        _save_sidecar(sidecar, boxes, pixels)
+
+    ends = np.cumsum(boxes[:, 2] * boxes[:, 3])
+    crops = [chunk.reshape(h, w) for chunk, (_, _, w, h) in zip(np.split(pixels, ends[:-1]), boxes)]
+    segments = (boxes, crops)
+    with _segments_lock:
+        _segments[digest] = segments
+        _segments.move_to_end(digest)
+        while len(_segments) > MAX_SEGMENTS:
+            _segments.popitem(last=False)
+    return segments
+
+def segment_characters(image_path):
+    """
+    Detect characters from a full-page handwriting sample.
+    Assumes characters A-Z followed by 0-9 are written clearly (in any layout).
+    """
+    _, crops = load_segments(image_path)
+    if len(crops) < len(EXPECTED_CHARS):
         print("Warning: Fewer characters detected than expected.")
 
-    characters = {}
-    for i, box in enumerate(sorted_boxes[:len(expected_chars)]):
-        x, y, w, h = box
-        char_img = img[y:y+h, x:x+w]
-        pil_char = Image.fromarray(255 - char_img)
-        characters[expected_chars[i]] = pil_char
-
-    return characters
-
-def render_handwriting(sample_path, text, output_path):
-    characters = segment_characters(sample_path)
-    canvas = Image.new('L', (1200, 800), color=255)
-    draw = ImageDraw.Draw(canvas)
-
-    x, y = 20, 20
-    for char in text.upper():
-        if char == '\n':
-            y += 60
-            x = 20
-            continue
-        elif char == ' ':
-            x += 25
-            continue
-        elif char not in characters:
-            continue
-
-        ch_img = characters[char]
-        canvas.paste(ch_img, (x, y))
-        x += ch_img.width + 10
-
-        if x > 1000:
-            y += 60
-            x = 20
-
-    canvas.save(output_path)
+    return {char: Image.fromarray(crop) for char, crop in zip(EXPECTED_CHARS, crops)}
+
+def fallback_characters(chars, height, fonts=DEFAULT_FALLBACKS):
+    """
+    (image, top) for characters the sample doesn't have, drawn from the first
+    font covering them. Images are in the same white-on-black form as the
+    segmented ones; top is how far the image reaches above the baseline.
+    """
+    paths = [path for path in fonts if os.path.exists(path)]
+    if not paths or not chars:
+        return {}
+    stack = get_font_stack(paths[0], paths[1:])
+
+    text = "".join(chars)
+    images = {}
+    for start, end, index in stack.split(text):
+        face = stack.fonts[index].ft_face(height)
+        for ch in text[start:end]:
+            glyph = rasterize_glyph(face, face.get_char_index(ch))
+            if glyph.bitmap.size:
+                images[ch] = (Image.fromarray(glyph.bitmap), glyph.top)
+    return images
+
+def _draw_word(image, word, characters, x, letter_gap, baseline, rises):
+    """
+    Copy a word's letters into image from x on, each with its bottom `rise`
+    pixels above the baseline row.
+    """
+    for char in word:
+        h, w = characters[char].shape
+        bottom = baseline - rises.get(char, 0)
+        image[bottom - h:bottom, x:x + w] = characters[char]
+        x += w + letter_gap
+
+def _split_word(word, widths, letter_gap, max_width):
+    """
+    Pieces of a word too wide for a line, each the longest run of letters
+    that fits (at least one letter).
+    """
+    # Right edge of every letter, measured from the start of the word
+    edges = np.cumsum([widths[char] + letter_gap for char in word]) - letter_gap
+    pieces, start, left = [], 0, 0
+    while start < len(word):
+        end = max(int(np.searchsorted(edges, left + max_width, side="right")), start + 1)
+        pieces.append(word[start:end])
+        start, left = end, edges[end - 1] + letter_gap
+    return pieces
+
+def _break_lines(text, widths, letter_gap, measure, max_width, space):
+    """
+    Greedy word wrap over measured word widths; a word wider than a line is
+    split between letters. Returns lines of words.
+    """
+    lines = []
+    for paragraph in text.split("\n"):
+        line, width = [], 0
+        for word in paragraph.split():
+            word = "".join(char for char in word if char in widths)
+            if not word:
+                continue
+            if len(word) > 1 and measure(word) > max_width:
+                *heads, word = _split_word(word, widths, letter_gap, max_width)
+                if line:
+                    lines.append(line)
+                lines.extend([head] for head in heads)
+                line, width = [], 0
+            w = measure(word)
+            if line and width + space + w > max_width:
+                lines.append(line)
+                line, width = [], 0
+            width += (space if line else 0) + w
+            line.append(word)
+        lines.append(line)
+    return lines
+
+def layout_handwriting(characters, text, page_width=1200, page_height=None, margin=20,
+                       line_height=60, letter_gap=10, space=25, rises=None):
+    """
+    Black-on-white pages of text written with the sample's letters. Lines
+    wrap at word boundaries within the margins. Without page_height there is
+    one page as tall as the text; otherwise lines are split over pages.
+
+    Letters stand on the baseline unless rises gives, per character, how far
+    above it (or below, if negative) its bottom goes, as for a font's
+    apostrophe or comma.
+
+    Words are measured from the crop widths alone. Nothing overlaps, so
+    drawing is plain slice copies: a word used more than once is drawn once
+    as a sprite, each distinct line is built once, and every line of a page
+    is a single copy of its line image.
+    """
+    widths = {char: crop.shape[1] for char, crop in characters.items()}
+    measured = {}
+
+    def measure(word):
+        if word not in measured:
+            measured[word] = sum(widths[char] for char in word) + letter_gap * (len(word) - 1)
+        return measured[word]
+
+    lines = _break_lines(text.upper(), widths, letter_gap, measure, page_width - 2 * margin, space)
+    counts = Counter(word for line in lines for word in line)
+    rises = rises or {}
+    # Rows every line needs above and below its baseline
+    ascent = max((crop.shape[0] + rises.get(char, 0) for char, crop in characters.items()), default=0)
+    descent = max([-rise for rise in rises.values()] + [0])
+    cell = ascent + descent
+    line_height = max(line_height, cell)
+    if page_height is None:
+        per_page = max(len(lines), 1)
+        page_height = 2 * margin + per_page * line_height
+    else:
+        per_page = max(1, (page_height - 2 * margin) // line_height)
+
+    # Coverage of repeated words and ink-on-white lines, with the baseline
+    # at the same row of every one
+    sprites = {}
+    line_images = {}
+
+    def line_image(line):
+        key = tuple(line)
+        if key not in line_images:
+            image = np.zeros((cell, sum(map(measure, line)) + space * (len(line) - 1)), dtype=np.uint8)
+            x = 0
+            for word in line:
+                w = measure(word)
+                if counts[word] > 1:
+                    if word not in sprites:
+                        sprites[word] = np.zeros((cell, w), dtype=np.uint8)
+                        _draw_word(sprites[word], word, characters, 0, letter_gap, ascent, rises)
+                    image[:, x:x + w] = sprites[word]
+                else:
+                    _draw_word(image, word, characters, x, letter_gap, ascent, rises)
+                x += w + space
+            line_images[key] = 255 - image
+        return line_images[key]
+
+    pages = []
+    for first in range(0, max(len(lines), 1), per_page):
+        canvas = np.full((page_height, page_width), 255, dtype=np.uint8)
+        for row, line in enumerate(lines[first:first + per_page]):
+            if line:
+                top = margin + row * line_height
+                # A letter wider than the line, or a line below a short page,
+                # is cut off at the edge of the page
+                image = line_image(line)[:max(page_height - top, 0), :max(page_width - margin, 0)]
+                canvas[top:top + image.shape[0], margin:margin + image.shape[1]] = image
+        pages.append(canvas)
+    return pages
+
+def render_handwriting(sample_path, text, output_path, page_width=1200, page_height=None):
+    """
+    Write text with the sample's letters and save it. A single page goes to
+    output_path; more pages are saved as one multi-page file for .tif/.pdf,
+    or as output-2.png, output-3.png, ... otherwise. Returns the paths written.
+    """
+    characters = {char: np.asarray(img) for char, img in segment_characters(sample_path).items()}
+
+    # Punctuation and anything else the sample lacks comes from a font, placed
+    # on the baseline by the font's own metrics
+    rises = {}
+    missing = sorted(set(text.upper()) - set(characters) - {" ", "\n"})
+    if missing:
+        height = int(np.median([crop.shape[0] for crop in characters.values()])) if characters else 40
+        for char, (img, top) in fallback_characters(missing, height).items():
+            characters[char] = np.asarray(img)
+            rises[char] = top - img.height
+
+    pages = layout_handwriting(characters, text, page_width, page_height, rises=rises)
+    images = [Image.fromarray(page) for page in pages]
+    stem, ext = os.path.splitext(output_path)
+    if len(images) == 1 or ext.lower() in (".tif", ".tiff", ".pdf"):
+        images[0].save(output_path, save_all=len(images) > 1, append_images=images[1:])
+        return [output_path]
+
+    paths = [output_path] + [f"{stem}-{n}{ext}" for n in range(2, len(images) + 1)]
+    for image, path in zip(images, paths):
+        image.save(path)
+    return paths
+
+def benchmark(sample_path, text, repeat=5):
+    """
+    Characters per second for laying out and drawing text (segmentation is
+    cached, so it is paid once up front), next to pasting one letter at a
+    time onto the same canvas.
+    """
+    import time
+
+    characters = {char: np.asarray(img) for char, img in segment_characters(sample_path).items()}
+    images = {char: Image.fromarray(255 - crop) for char, crop in characters.items()}
+    count = sum(char in characters for char in text.upper())
+    height, width = layout_handwriting(characters, text)[0].shape
+
+    def paste_loop():
+        canvas = Image.new('L', (width, height), color=255)
+        x, y = 20, 20
+        for char in text.upper():
+            if char == '\n':
+                x, y = 20, y + 60
+            elif char == ' ':
+                x += 25
+            elif char in images:
+                if x + images[char].width > width - 20:
+                    x, y = 20, y + 60
+                canvas.paste(images[char], (x, y))
+                x += images[char].width + 10
+
+    rows = []
+    for name, run in (("paste", paste_loop), ("batched", lambda: layout_handwriting(characters, text))):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            run()
+        rows.append((name, count * repeat / (time.perf_counter() - start)))
+    return rows
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3:
+        print("Usage: python -m utils.handwriting_renderer sample.png text.txt")
+        sys.exit(1)
+
+    with open(sys.argv[2], encoding="utf-8") as f:
+        text = f.read()
+    for name, rate in benchmark(sys.argv[1], text):
+        print(f"{name:>8}: {rate:,.0f} characters/s")
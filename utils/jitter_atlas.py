@@ -0,0 +1,187 @@
+import threading
+
+import cv2
+import numpy as np
+
+from utils.glyph_atlas import atlas_base, load_atlas, pack_glyphs, prune_atlases, save_atlas, ATLAS_WIDTH
+from utils.glyph_cache import CachedGlyph, GlyphCache, rasterize_glyph
+
+VARIANTS = 4            # transformed copies kept per glyph
+MAX_ROTATION = 2.5      # degrees either way, about the pen origin
+MAX_SCALE = 0.04        # fraction of the size either way
+MAX_SHIFT = 0.025       # baseline shift as a fraction of the size
+MAX_WEIGHT = 0.4        # blend towards a dilated (or eroded) stroke
+
+
+def variant_params(glyph_id, variant):
+    """
+    (rotation, scale, baseline shift, stroke weight) of one variant. Seeded by
+    glyph and variant only, so a variant looks the same at every size.
+    """
+    rng = np.random.default_rng((glyph_id, variant))
+    return (
+        rng.uniform(-MAX_ROTATION, MAX_ROTATION),
+        1 + rng.uniform(-MAX_SCALE, MAX_SCALE),
+        rng.uniform(-MAX_SHIFT, MAX_SHIFT),
+        rng.uniform(-MAX_WEIGHT, MAX_WEIGHT),
+    )
+
+
+def jitter_glyph(glyph, size, params):
+    """
+    Rotate and scale a glyph about its pen origin, shift it off the baseline
+    and thicken or thin its strokes. The advance is left alone so the layout
+    doesn't change.
+    """
+    h, w = glyph.bitmap.shape
+    if not h or not w:
+        return glyph
+    angle, scale, shift, weight = params
+
+    pad = max(2, int(size * (MAX_SCALE + MAX_SHIFT)) + 2)
+    src = np.zeros((h + 2 * pad, w + 2 * pad), dtype=np.uint8)
+    src[pad:pad + h, pad:pad + w] = glyph.bitmap
+    origin = (float(pad - glyph.left), float(pad + glyph.top))
+    matrix = cv2.getRotationMatrix2D(origin, angle, scale)
+    matrix[1, 2] += shift * size
+    out = cv2.warpAffine(src, matrix, (src.shape[1], src.shape[0]), flags=cv2.INTER_LINEAR)
+
+    kernel = np.ones((2, 2), dtype=np.uint8)
+    stroke = cv2.dilate(out, kernel) if weight > 0 else cv2.erode(out, kernel)
+    out = cv2.addWeighted(out, 1 - abs(weight), stroke, abs(weight), 0)
+
+    rows, cols = np.nonzero(out)
+    if not rows.size:
+        return CachedGlyph(np.zeros((0, 0), dtype=np.uint8), 0, 0, glyph.advance_x, glyph.advance_y)
+    y0, y1, x0, x1 = rows.min(), rows.max() + 1, cols.min(), cols.max() + 1
+    return CachedGlyph(
+        np.ascontiguousarray(out[y0:y1, x0:x1]),
+        glyph.left - pad + int(x0),
+        glyph.top + pad - int(y0),
+        glyph.advance_x,
+        glyph.advance_y,
+    )
+
+
+def pick_variant(seed, x, y, glyph_id, variants=VARIANTS):
+    """
+    Deterministic variant for a glyph at pen position (x, y): the same seed
+    and layout always give the same output, neighbours rarely match.
+    """
+    h = (seed * 0x9E3779B1 ^ x * 0x85EBCA77 ^ y * 0xC2B2AE3D ^ glyph_id * 0x27D4EB2F) & 0xFFFFFFFF
+    h ^= h >> 15
+    h = (h * 0x2C1B3C6D) & 0xFFFFFFFF
+    h ^= h >> 12
+    return h % variants
+
+
+def build_jitter_atlas(font, sizes, variants=VARIANTS):
+    """
+    Every glyph at each size, transformed `variants` ways, packed into one
+    buffer plus an index of shape (len(sizes), variants, num_glyphs, 8) in the
+    column layout of the plain atlas.
+    """
+    bitmaps, metrics = [], []
+    for size in sizes:
+        face = font.ft_face(size)
+        plain = [rasterize_glyph(face, gid) for gid in range(face.num_glyphs)]
+        for variant in range(variants):
+            for gid, glyph in enumerate(plain):
+                glyph = jitter_glyph(glyph, size, variant_params(gid, variant))
+                bitmaps.append(glyph.bitmap)
+                metrics.append((glyph.left, glyph.top, glyph.advance_x, glyph.advance_y))
+
+    positions, height = pack_glyphs(bitmaps)
+    pixels = np.zeros((max(height, 1), ATLAS_WIDTH), dtype=np.uint8)
+    index = np.zeros((len(bitmaps), 8), dtype=np.int32)
+    for i, (bitmap, (x, y), m) in enumerate(zip(bitmaps, positions, metrics)):
+        h, w = bitmap.shape
+        pixels[y:y + h, x:x + w] = bitmap
+        index[i] = (x, y, w, h) + m
+    return pixels, index.reshape(len(sizes), variants, -1, 8)
+
+
+class JitterAtlas:
+    """
+    Read-only variants of every glyph of the handwriting font, transformed
+    once per font version instead of per glyph per request. get() hands out
+    the untransformed glyph from `fallback`, like any glyph source; variant()
+    hands out one of the transformed copies. Sizes the atlas doesn't hold are
+    transformed on first use and kept in an LRU.
+    """
+
+    def __init__(self, font_hash, sizes, pixels, index, fallback=None, max_glyphs=4096):
+        self.font_hash = font_hash
+        self.sizes = {int(size): i for i, size in enumerate(sizes)}
+        self.variants = index.shape[1]
+        self.pixels = pixels
+        self.index = index
+        self.fallback = fallback or GlyphCache()
+        # Glyph ids of this cache are (glyph id, variant) pairs
+        self.cache = GlyphCache(max_glyphs, rasterize=self._transform)
+        self._glyphs = {}
+
+    def _transform(self, face, size, key):
+        glyph_id, variant = key
+        return jitter_glyph(rasterize_glyph(face, glyph_id), size, variant_params(glyph_id, variant))
+
+    def get(self, face, font_hash, size, glyph_id, phase=0):
+        return self.fallback.get(face, font_hash, size, glyph_id, phase)
+
+    def pick(self, seed, x, y, glyph_id):
+        return pick_variant(seed, x, y, glyph_id, self.variants)
+
+    def variant(self, face, font_hash, size, glyph_id, variant):
+        if font_hash != self.font_hash:
+            return self.fallback.get(face, font_hash, size, glyph_id)
+        glyph = self._glyphs.get((size, glyph_id, variant))
+        if glyph is not None:
+            return glyph
+
+        slot = self.sizes.get(size)
+        if slot is None or glyph_id >= self.index.shape[2]:
+            return self.cache.get(face, font_hash, size, (glyph_id, variant))
+
+        x, y, w, h, left, top, advance_x, advance_y = self.index[slot, variant, glyph_id].tolist()
+        glyph = CachedGlyph(self.pixels[y:y + h, x:x + w], left, top, advance_x, advance_y)
+        self._glyphs[(size, glyph_id, variant)] = glyph
+        return glyph
+
+    def nbytes(self):
+        return self.pixels.nbytes + self.index.nbytes
+
+
+def load_or_build_jitter_atlas(font, sizes, variants=VARIANTS, directory=None, fallback=None):
+    sizes = tuple(sorted(set(sizes)))
+    base = atlas_base(font, directory, kind="jitter-atlas", sizes=sizes)
+
+    saved = load_atlas(base)
+    if saved is not None:
+        pixels, arrays = saved
+        if tuple(arrays["sizes"].tolist()) == sizes and arrays["index"].shape[1] == variants:
+            return JitterAtlas(font.hash, sizes, pixels, arrays["index"], fallback)
+
+    pixels, index = build_jitter_atlas(font, sizes, variants)
+    pixels = save_atlas(base, pixels, index=index, sizes=np.array(sizes))
+    prune_atlases(font, directory)
+    return JitterAtlas(font.hash, sizes, pixels, index, fallback)
+
+
+_atlases = {}
+_lock = threading.Lock()
+
+
+def get_jitter_atlas(font, sizes, variants=VARIANTS, directory=None, fallback=None):
+    """
+    Jitter atlas for the current version of the font, loaded once per process
+    and rebuilt when the font file changes.
+    """
+    key = (font.path, tuple(sorted(set(sizes))), variants, directory)
+    atlas = _atlases.get(key)
+    if atlas is None or atlas.font_hash != font.hash:
+        with _lock:
+            atlas = _atlases.get(key)
+            if atlas is None or atlas.font_hash != font.hash:
+                atlas = load_or_build_jitter_atlas(font, sizes, variants, directory, fallback)
+                _atlases[key] = atlas
+    return atlas
@@ -0,0 +1,194 @@
+from collections import namedtuple
+
+from utils.shaping import BREAK_CHARS, default_cache
+
+# All positions and widths below are in 26.6 pixels unless noted otherwise.
+
+# A shaped word plus the whitespace glyphs that follow it
+Word = namedtuple("Word", ["glyphs", "width", "space_glyphs", "space_width"])
+
+# Text shaped once and measured; can be laid out again at any page size
+Measured = namedtuple("Measured", ["font", "size", "paragraphs", "ascender", "descender", "line_gap"])
+
+# One line of glyphs starting at baseline origin (x, y)
+GlyphRun = namedtuple("GlyphRun", ["x", "y", "width", "glyphs"])
+
+# Page width and height are in whole pixels
+Page = namedtuple("Page", ["number", "width", "height", "runs"])
+
+
+def measure_text(font, text, size, features=None, cache=None):
+    """
+    Shape every word of every paragraph through the shaping cache and record
+    its advance width.
+    """
+    cache = cache or default_cache
+    extents = font.hb_font(size).get_font_extents("ltr")
+
+    paragraphs = []
+    for para in text.split("\n"):
+        words = []
+        for _, run, glyphs in cache.shape_runs(font, para, size, features):
+            width = sum(g.x_advance for g in glyphs)
+            if run in BREAK_CHARS:
+                if not words:
+                    # Leading whitespace hangs off an empty word
+                    words.append(Word([], 0, [], 0))
+                last = words[-1]
+                words[-1] = last._replace(
+                    space_glyphs=last.space_glyphs + glyphs,
+                    space_width=last.space_width + width,
+                )
+            else:
+                words.append(Word(glyphs, width, [], 0))
+        paragraphs.append(words)
+
+    return Measured(font, size, paragraphs, extents.ascender, extents.descender, extents.line_gap)
+
+
+def _split_long_words(words, max_width):
+    """
+    Break words wider than the line into glyph chunks that fit.
+    """
+    if all(w.width <= max_width for w in words):
+        return words
+
+    result = []
+    for word in words:
+        if word.width <= max_width:
+            result.append(word)
+            continue
+        chunk, width = [], 0
+        for g in word.glyphs:
+            if chunk and width + g.x_advance > max_width:
+                result.append(Word(chunk, width, [], 0))
+                chunk, width = [], 0
+            chunk.append(g)
+            width += g.x_advance
+        result.append(Word(chunk, width, word.space_glyphs, word.space_width))
+    return result
+
+
+def _break_greedy(words, max_width):
+    lines = []
+    start, width = 0, 0
+    for i, word in enumerate(words):
+        if i == start:
+            width = word.width
+            continue
+        new_width = width + words[i - 1].space_width + word.width
+        if new_width > max_width:
+            lines.append((start, i))
+            start, width = i, word.width
+        else:
+            width = new_width
+    lines.append((start, len(words)))
+    return lines
+
+
+def _break_optimal(words, max_width):
+    """
+    Minimum raggedness: minimise the sum of squared slack over every line but
+    the last. Each line only looks back as far as fits, so this stays linear in
+    the number of words for a fixed line width.
+    """
+    n = len(words)
+    cost = [0.0] + [float("inf")] * n
+    prev = [0] * (n + 1)
+    for j in range(1, n + 1):
+        width = words[j - 1].width
+        for i in range(j - 1, -1, -1):
+            if i < j - 1:
+                width += words[i].width + words[i].space_width
+                if width > max_width:
+                    break
+            slack = 0 if j == n else (max_width - width) / 64
+            total = cost[i] + slack * slack
+            if total < cost[j]:
+                cost[j], prev[j] = total, i
+
+    lines = []
+    j = n
+    while j > 0:
+        lines.append((prev[j], j))
+        j = prev[j]
+    lines.reverse()
+    return lines
+
+
+def _margins(margin):
+    if isinstance(margin, (int, float)):
+        return margin, margin, margin, margin
+    return margin
+
+
+def paragraph_lines(words, max_width, mode="greedy"):
+    """
+    Break one measured paragraph into lines of (glyphs, width). A blank
+    paragraph is a single empty line.
+    """
+    words = _split_long_words(words, max_width)
+    break_lines = _break_optimal if mode == "optimal" else _break_greedy
+    lines = []
+    for start, end in break_lines(words, max_width) if words else [(0, 0)]:
+        glyphs, width = [], 0
+        for k in range(start, end):
+            glyphs.extend(words[k].glyphs)
+            width += words[k].width
+            if k < end - 1:
+                glyphs.extend(words[k].space_glyphs)
+                width += words[k].space_width
+        lines.append((glyphs, width))
+    return lines
+
+
+def layout(measured, page_width, page_height=None, margin=40, line_height=None, mode="greedy",
+           baseline=None):
+    """
+    Break measured paragraphs into lines and lines into pages.
+
+    margin is one value or (top, right, bottom, left), in pixels. line_height
+    is in pixels and defaults to the font's own line spacing. baseline puts
+    the first line's baseline at that many pixels from the top instead of an
+    ascender below the top margin. mode is "greedy" or "optimal". With
+    page_height=None everything goes on one page that is as tall as the text
+    needs.
+    """
+    top, right, bottom, left = _margins(margin)
+    max_width = int((page_width - left - right) * 64)
+    if line_height is None:
+        step = measured.ascender - measured.descender + measured.line_gap
+    else:
+        step = int(line_height * 64)
+    if baseline is None:
+        first_baseline = int(top * 64) + measured.ascender
+    else:
+        first_baseline = int(baseline * 64)
+    bottom_limit = None if page_height is None else int((page_height - bottom) * 64)
+
+    pages = []
+    runs = []
+    y = first_baseline
+    for words in measured.paragraphs:
+        for glyphs, width in paragraph_lines(words, max_width, mode):
+            # Blank lines take up room too, so any line already on the page
+            # counts, not only lines with glyphs
+            if bottom_limit is not None and y > first_baseline and y - measured.descender > bottom_limit:
+                pages.append(Page(len(pages), page_width, page_height, runs))
+                runs = []
+                y = first_baseline
+
+            if glyphs:
+                runs.append(GlyphRun(int(left * 64), y, width, glyphs))
+            y += step
+
+    if page_height is None:
+        # Grow to fit the last line
+        last_baseline = max(y - step, first_baseline)
+        page_height = -(-(last_baseline - measured.descender) // 64) + int(bottom)
+    pages.append(Page(len(pages), page_width, page_height, runs))
+    return pages
+
+
+def layout_text(font, text, size, page_width, page_height=None, features=None, cache=None, **kwargs):
+    return layout(measure_text(font, text, size, features, cache), page_width, page_height, **kwargs)
@@ -0,0 +1,62 @@
+import json
+import struct
+
+import numpy as np
+
+from utils.font_stack import fonts_of
+
+# Positions are exported in 26.6 fixed point: divide by 64 for pixels
+UNITS_PER_PIXEL = 64
+MAGIC = b"HWL2"
+
+
+def page_arrays(page):
+    """
+    Glyph id, pen x, pen y, advance and font index of every glyph on a page
+    as int32 arrays. x and y already include the glyph's offset, so a client
+    draws each glyph at (x, y) with y growing downwards.
+    """
+    rows = []
+    for run in page.runs:
+        pen_x, pen_y = run.x, run.y
+        for g in run.glyphs:
+            rows.append((g.glyph_id, pen_x + g.x_offset, pen_y - g.y_offset, g.x_advance, g.font))
+            pen_x += g.x_advance
+            pen_y -= g.y_advance
+    return np.array(rows, dtype=np.int32).reshape(-1, 5).T
+
+
+def layout_json(pages, font, size):
+    # Font indices in the pages refer to this list (handwriting font first)
+    doc = {
+        "fonts": [source.hash for source in fonts_of(font)],
+        "size": size,
+        "units_per_pixel": UNITS_PER_PIXEL,
+        "pages": [],
+    }
+    for page in pages:
+        glyphs, x, y, advance, fonts = page_arrays(page).tolist()
+        doc["pages"].append({
+            "width": page.width, "height": page.height,
+            "glyphs": glyphs, "x": x, "y": y, "advance": advance, "font": fonts,
+        })
+    return json.dumps(doc, separators=(",", ":")).encode("utf-8")
+
+
+def layout_binary(pages, font, size):
+    """
+    Little-endian packed layout:
+
+        b"HWL2", u32 units per pixel, u32 size, u32 page count, u32 font count f,
+        f x 20-byte sha1 of each font (handwriting font first)
+        per page: u32 width, u32 height, u32 glyph count n, then i32[n] glyph ids,
+                  i32[n] x, i32[n] y, i32[n] advances, i32[n] font indices
+    """
+    fonts = fonts_of(font)
+    out = [MAGIC, struct.pack("<IIII", UNITS_PER_PIXEL, size, len(pages), len(fonts))]
+    out.extend(bytes.fromhex(source.hash) for source in fonts)
+    for page in pages:
+        arrays = page_arrays(page)
+        out.append(struct.pack("<III", page.width, page.height, arrays.shape[1]))
+        out.append(arrays.astype("<i4").tobytes())
+    return b"".join(out)
@@ -0,0 +1,233 @@
+import json
+import queue
+import threading
+from collections import OrderedDict
+
+from utils.encode import encode_image
+from utils.layout import GlyphRun, Page, measure_text, paragraph_lines
+from utils.raster import render_page
+from utils.render_output import data_uri
+
+# Patches waiting on a session's event stream before it is resynchronised
+MAX_PATCHES = 8
+
+
+def _common_prefix(a, b, limit):
+    n = 0
+    while n < limit and a[n] == b[n]:
+        n += 1
+    return n
+
+
+def _common_suffix(a, b, limit):
+    n = 0
+    while n < limit and a[len(a) - 1 - n] == b[len(b) - 1 - n]:
+        n += 1
+    return n
+
+
+class LiveSession:
+    """
+    Last layout of one as-you-type preview. Each update diffs the new text
+    against it by paragraph, re-shapes only the paragraphs that changed and
+    re-renders only the lines that changed, so a one character edit costs the
+    same however long the document is.
+
+    Lines sit on a fixed pixel grid, one line box per line. update() returns
+    a patch: an optional shift of everything below the edit (when it added or
+    removed lines) followed by PNG tiles for the changed line boxes. A patch
+    with "full" set redraws the whole preview instead of applying on top of
+    the previous one.
+    """
+
+    def __init__(self, font, size, page_width, margin=20, glyph_cache=None):
+        self.font = font
+        self.size = size
+        self.page_width = page_width
+        self.margin = margin
+        self.glyph_cache = glyph_cache
+        self.max_width = (page_width - 2 * margin) * 64
+
+        metrics = measure_text(font, "", size)
+        self.ascender = metrics.ascender
+        # Whole pixels per line so tiles never straddle a pixel row
+        self.step = -(-(metrics.ascender - metrics.descender + metrics.line_gap) // 64)
+
+        self.paragraphs = []  # [(text, line count)]
+        self.lines = []       # glyph list of every line, top to bottom
+        self.version = 0
+        self.needs_full = True
+        self.lock = threading.Lock()
+
+    def height(self, line_count=None):
+        count = len(self.lines) if line_count is None else line_count
+        return 2 * self.margin + max(count, 1) * self.step
+
+    def _line_top(self, i):
+        return self.margin + i * self.step
+
+    def _render_lines(self, start, end):
+        """
+        PNG of line boxes start..end. The neighbouring lines are drawn too so
+        ascenders and descenders that reach into these boxes are kept.
+        """
+        y0, y1 = self._line_top(start), self._line_top(end)
+        runs = []
+        for i in range(max(start - 1, 0), min(end + 1, len(self.lines))):
+            if self.lines[i]:
+                baseline = (self._line_top(i) - y0) * 64 + self.ascender
+                runs.append(GlyphRun(self.margin * 64, baseline, 0, self.lines[i]))
+        page = Page(0, self.page_width, y1 - y0, runs)
+        canvas = render_page(page, self.font, self.size, self.glyph_cache)
+        return {"y": y0, "image": data_uri(encode_image(canvas)[0])}
+
+    def _full_patch(self):
+        return {"version": self.version, "width": self.page_width, "height": self.height(),
+                "shift": None, "full": True, "tiles": [self._render_lines(0, max(len(self.lines), 1))]}
+
+    def _publish(self, events, patch):
+        """
+        Queue a patch for the event stream. A stream that has fallen
+        MAX_PATCHES behind (or has no reader) gets one full patch in place of
+        its backlog, since only the latest state matters.
+        """
+        try:
+            events.put_nowait(patch)
+        except queue.Full:
+            while True:
+                try:
+                    events.get_nowait()
+                except queue.Empty:
+                    break
+            events.put_nowait(patch if patch["full"] else self._full_patch())
+
+    def update(self, text, events=None):
+        """
+        Apply the new text and return its patch. With events, the patch is
+        queued while the session is still locked, so patches reach the stream
+        in version order.
+        """
+        with self.lock:
+            old_paras = self.paragraphs
+            new_texts = text.split("\n")
+            old_texts = [para for para, _ in old_paras]
+
+            # Paragraphs untouched at either end keep their shaped lines
+            limit = min(len(old_texts), len(new_texts))
+            head = _common_prefix(old_texts, new_texts, limit)
+            tail = _common_suffix(old_texts, new_texts, limit - head)
+
+            first_line = sum(count for _, count in old_paras[:head])
+            old_mid = sum(count for _, count in old_paras[head:len(old_paras) - tail])
+
+            new_mid_paras, new_mid_lines = [], []
+            for para in new_texts[head:len(new_texts) - tail]:
+                words = measure_text(self.font, para, self.size).paragraphs[0]
+                lines = [glyphs for glyphs, _ in paragraph_lines(words, self.max_width)]
+                new_mid_paras.append((para, len(lines)))
+                new_mid_lines.extend(lines)
+
+            old_lines = self.lines[first_line:first_line + old_mid]
+            self.paragraphs = old_paras[:head] + new_mid_paras + old_paras[len(old_paras) - tail:]
+            self.lines = self.lines[:first_line] + new_mid_lines + self.lines[first_line + old_mid:]
+
+            # Narrow down to the lines that really differ inside the edited paragraphs
+            limit = min(len(old_lines), len(new_mid_lines))
+            same_head = _common_prefix(old_lines, new_mid_lines, limit)
+            same_tail = _common_suffix(old_lines, new_mid_lines, limit - same_head)
+            start = first_line + same_head
+            old_end = first_line + len(old_lines) - same_tail
+            new_end = first_line + len(new_mid_lines) - same_tail
+
+            self.version += 1
+            if self.needs_full:
+                self.needs_full = False
+                patch = self._full_patch()
+            else:
+                patch = {"version": self.version, "width": self.page_width, "height": self.height(),
+                         "shift": None, "full": False, "tiles": []}
+                if new_end != old_end:
+                    patch["shift"] = {"y": self._line_top(old_end), "dy": (new_end - old_end) * self.step}
+                if new_end > start:
+                    patch["tiles"].append(self._render_lines(start, new_end))
+                elif start < len(self.lines):
+                    # Lines were only removed; redraw the one that moved up into the gap
+                    patch["tiles"].append(self._render_lines(start, start + 1))
+            if events is not None:
+                self._publish(events, patch)
+            return patch
+
+
+class LiveSessions:
+    """
+    Bounded set of live preview sessions, least recently used dropped first.
+    Every session has a bounded queue its event stream reads patches from.
+    A dropped session's stream is closed, so the browser reconnects and gets
+    a new session instead of waiting on a queue nobody feeds.
+    """
+
+    def __init__(self, max_sessions=256):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id, create, fresh=None):
+        """
+        (session, queue) for an id. The session is replaced, keeping its queue,
+        when fresh(session) says it no longer matches the request.
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = (create(), queue.Queue(maxsize=MAX_PATCHES))
+                self._sessions[session_id] = entry
+                while len(self._sessions) > self.max_sessions:
+                    _, (_, events) = self._sessions.popitem(last=False)
+                    _close(events)
+            elif fresh is not None and not fresh(entry[0]):
+                session = create()
+                if entry[0] is not None:
+                    # Versions keep counting up so the client never takes a
+                    # new patch for an old one
+                    session.version = entry[0].version
+                entry = (session, entry[1])
+                self._sessions[session_id] = entry
+            self._sessions.move_to_end(session_id)
+            return entry
+
+    def clear(self):
+        with self._lock:
+            for _, events in self._sessions.values():
+                _close(events)
+            self._sessions.clear()
+
+
+def _close(events):
+    # None on the queue ends the event stream reading it
+    while True:
+        try:
+            events.put_nowait(None)
+            return
+        except queue.Full:
+            try:
+                events.get_nowait()
+            except queue.Empty:
+                pass
+
+
+def sse_events(events, keepalive=15):
+    """
+    Server-Sent Events stream of the patches put on a session's queue, until
+    the session is dropped.
+    """
+    yield "retry: 1000\n\n"
+    while True:
+        try:
+            patch = events.get(timeout=keepalive)
+        except queue.Empty:
+            # Comment line keeps proxies from closing an idle stream
+            yield ": keepalive\n\n"
+            continue
+        if patch is None:
+            return
+        yield f"id: {patch['version']}\nevent: patch\ndata: {json.dumps(patch)}\n\n"
@@ -0,0 +1,143 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+# Paper geometry in points (1/72 inch): rule spacing, first rule from the top,
+# x of the vertical margin line and grid spacing. None means not drawn.
+PaperStyle = namedtuple("PaperStyle", ["rule", "top", "margin_line", "grid"])
+
+PAPER_STYLES = {
+    # Wide ruled (8.7 mm) and college ruled (7.1 mm) with a margin line
+    "ruled": PaperStyle(24.66, 72, 90, None),
+    "college": PaperStyle(20.13, 72, 90, None),
+    # 5 mm squares
+    "grid": PaperStyle(14.17, 28.35, None, 14.17),
+}
+
+RULE_GRAY = 190
+MARGIN_GRAY = 150
+GRID_GRAY = 215
+
+
+def _px(points, dpi):
+    return None if points is None else points * dpi / 72
+
+
+def _line_width(dpi):
+    return max(1, round(dpi / 96))
+
+
+def _draw(canvas, style, dpi):
+    """
+    Draw the paper onto a white canvas with plain numpy slicing.
+    """
+    height, width = canvas.shape
+    thick = _line_width(dpi)
+    rule, top, margin_line, grid = (_px(v, dpi) for v in style)
+
+    if grid:
+        for x in np.arange(grid, width, grid).astype(int):
+            canvas[:, x:x + thick] = GRID_GRAY
+        rule = grid
+    if rule:
+        # Floored like layout() floors baselines, so text stays on the rules
+        for y in np.arange(top, height, rule).astype(int):
+            canvas[y:y + thick, :] = GRID_GRAY if grid else RULE_GRAY
+    if margin_line:
+        x = round(margin_line)
+        canvas[:, x:x + thick] = MARGIN_GRAY
+
+
+# Drawn paper kept at most, least recently used dropped first. Previews use
+# a DPI of their own per size, so keys keep coming.
+MAX_PAPER_BYTES = 32 * 1024 * 1024
+
+_masters = OrderedDict()
+_master_bytes = 0
+_lock = threading.Lock()
+
+
+def paper_background(style, width, height, dpi=72):
+    """
+    Read-only paper image of width x height pixels. Each style is drawn once
+    per (width, DPI) on a master buffer that only ever grows, so pages of any
+    height are a slice of it. Masters are kept in an LRU of MAX_PAPER_BYTES.
+    Copy the result to draw on top.
+    """
+    global _master_bytes
+    key = (style, width, dpi)
+    with _lock:
+        master = _masters.get(key)
+        if master is not None and master.shape[0] >= height:
+            _masters.move_to_end(key)
+            return master[:height]
+
+    rows = -(-max(height, 1) // 1024) * 1024
+    master = np.full((rows, width), 255, dtype=np.uint8)
+    _draw(master, PAPER_STYLES[style], dpi)
+    master.setflags(write=False)
+
+    with _lock:
+        old = _masters.pop(key, None)
+        if old is not None:
+            _master_bytes -= old.nbytes
+        if old is None or old.shape[0] < rows:
+            _masters[key] = master
+            _master_bytes += master.nbytes
+        else:
+            # Another thread drew a tall enough one meanwhile
+            _masters[key] = master = old
+            _master_bytes += old.nbytes
+        while _master_bytes > MAX_PAPER_BYTES and len(_masters) > 1:
+            _, dropped = _masters.popitem(last=False)
+            _master_bytes -= dropped.nbytes
+    return master[:height]
+
+
+def paper_layout(style, dpi, font, size):
+    """
+    layout() keyword arguments that put every baseline on a rule: line
+    height snapped to a whole number of rules and text right of the margin.
+    """
+    rule, top, margin_line, grid = (_px(v, dpi) for v in PAPER_STYLES[style])
+    rule = rule or grid
+    side = round(_px(56, dpi))
+    left = round(margin_line + _px(8, dpi)) if margin_line else side
+
+    extents = font.hb_font(size).get_font_extents("ltr")
+    step = (extents.ascender - extents.descender + extents.line_gap) / 64
+    rules_per_line = max(1, round(step / rule))
+    # Baselines sit on a rule, so descenders cross it like real writing
+    first = top + rule * rules_per_line
+    return {
+        "margin": (round(top), side, round(rule), left),
+        "line_height": rule * rules_per_line,
+        "baseline": first,
+    }
+
+
+def paper_form(style, width_pt, height_pt):
+    """
+    PDF content stream drawing the paper in points, for a Form XObject that
+    every page of a document reuses.
+    """
+    rule, top, margin_line, grid = PAPER_STYLES[style]
+    ops = ["q 0.5 w"]
+    if grid:
+        ops.append(f"{GRID_GRAY / 255:.3f} G")
+        x = grid
+        while x < width_pt:
+            ops.append(f"{x:.2f} 0 m {x:.2f} {height_pt} l S")
+            x += grid
+        rule = grid
+    if rule:
+        ops.append(f"{(GRID_GRAY if grid else RULE_GRAY) / 255:.3f} G")
+        y = top
+        while y < height_pt:
+            ops.append(f"0 {height_pt - y:.2f} m {width_pt} {height_pt - y:.2f} l S")
+            y += rule
+    if margin_line:
+        ops.append(f"{MARGIN_GRAY / 255:.3f} G {margin_line} 0 m {margin_line} {height_pt} l S")
+    ops.append("Q")
+    return "\n".join(ops).encode("latin-1")
@@ -0,0 +1,337 @@
+import io
+import zlib
+
+from fontTools.subset import Options, Subsetter
+from fontTools.ttLib import TTFont
+
+from utils.font_stack import fonts_of
+from utils.paper import paper_form
+
+A4_POINTS = (595, 842)
+
+
+def _fmt(value):
+    text = f"{value:.3f}".rstrip("0").rstrip(".")
+    return text if text not in ("", "-0") else "0"
+
+
+class PdfWriter:
+    """
+    Minimal PDF writer that sends each object to the output as soon as it is
+    complete, so memory does not grow with the number of pages.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.offsets = {}
+        self.next_num = 1
+        self.start = fp.tell()
+        fp.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def reserve(self):
+        num = self.next_num
+        self.next_num += 1
+        return num
+
+    def write_object(self, num, body):
+        self.offsets[num] = self.fp.tell() - self.start
+        self.fp.write(b"%d 0 obj\n" % num)
+        self.fp.write(body.encode("latin-1") if isinstance(body, str) else body)
+        self.fp.write(b"\nendobj\n")
+
+    def write_stream(self, num, data, extra="", compressed=False):
+        if not compressed:
+            data = zlib.compress(data)
+        header = f"<< /Length {len(data)} /Filter /FlateDecode {extra}>>\nstream\n"
+        self.write_object(num, header.encode("latin-1") + data + b"\nendstream")
+
+    def close(self, root_num):
+        xref = self.fp.tell() - self.start
+        lines = [f"xref\n0 {self.next_num}\n", "0000000000 65535 f \n"]
+        for num in range(1, self.next_num):
+            lines.append(f"{self.offsets.get(num, 0):010d} 00000 n \n")
+        lines.append(f"trailer\n<< /Size {self.next_num} /Root {root_num} 0 R >>\nstartxref\n{xref}\n%%EOF\n")
+        self.fp.write("".join(lines).encode("latin-1"))
+
+
+class _EmbeddedFont:
+    """
+    One font of the exporter, with the set of glyph ids used so far.
+    """
+
+    def __init__(self, font, num, tag):
+        self.font = font
+        self.num = num
+        self.tag = tag
+        self.used = {0}
+        self.tt = TTFont(io.BytesIO(font.data), lazy=True)
+        self.upem = self.tt["head"].unitsPerEm
+        self.hmtx = self.tt["hmtx"].metrics
+        self.glyph_order = self.tt.getGlyphOrder()
+
+    def glyph_width(self, gid):
+        # Width in PDF text space units (1/1000 em)
+        return self.hmtx[self.glyph_order[gid]][0] * 1000 / self.upem
+
+    def subset(self):
+        options = Options()
+        options.retain_gids = True
+        options.notdef_outline = True
+        options.layout_features = []
+        options.name_IDs = ["*"]
+        subsetter = Subsetter(options)
+        tt = TTFont(io.BytesIO(self.font.data))
+        subsetter.populate(gids=sorted(self.used))
+        subsetter.subset(tt)
+        out = io.BytesIO()
+        tt.save(out)
+        return out.getvalue()
+
+    def to_unicode(self):
+        # Alternates like a.alt1 map back to the character of their base glyph
+        by_name = {name: cp for cp, name in self.tt.getBestCmap().items()}
+        entries = []
+        for gid in sorted(self.used):
+            base = self.glyph_order[gid].split(".")[0]
+            if base in by_name and by_name[base] <= 0xFFFF:
+                entries.append(f"<{gid:04X}> <{by_name[base]:04X}>")
+
+        lines = [
+            "/CIDInit /ProcSet findresource begin 12 dict begin begincmap",
+            "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def",
+            "/CMapName /Adobe-Identity-UCS def /CMapType 2 def",
+            "1 begincodespacerange <0000> <FFFF> endcodespacerange",
+        ]
+        for i in range(0, len(entries), 100):
+            chunk = entries[i:i + 100]
+            lines.append(f"{len(chunk)} beginbfchar")
+            lines.extend(chunk)
+            lines.append("endbfchar")
+        lines.append("endcmap CMapName currentdict /CMap defineresource pop end end")
+        return "\n".join(lines).encode("latin-1")
+
+    def write(self, writer):
+        head, hhea = self.tt["head"], self.tt["hhea"]
+        per_em = 1000 / self.upem
+        ps_name = (self.tt["name"].getDebugName(6) or "Handwriting").replace(" ", "")
+        base_font = f"{self.tag}+{ps_name}"
+
+        file_num = writer.reserve()
+        writer.write_stream(file_num, self.subset())
+
+        descriptor_num = writer.reserve()
+        bbox = " ".join(_fmt(v * per_em) for v in (head.xMin, head.yMin, head.xMax, head.yMax))
+        writer.write_object(
+            descriptor_num,
+            f"<< /Type /FontDescriptor /FontName /{base_font} /Flags 4 "
+            f"/FontBBox [{bbox}] /ItalicAngle 0 /Ascent {_fmt(hhea.ascent * per_em)} "
+            f"/Descent {_fmt(hhea.descent * per_em)} /CapHeight {_fmt(hhea.ascent * per_em)} "
+            f"/StemV 80 /FontFile2 {file_num} 0 R >>",
+        )
+
+        widths = " ".join(f"{gid} [{_fmt(self.glyph_width(gid))}]" for gid in sorted(self.used))
+        cid_num = writer.reserve()
+        writer.write_object(
+            cid_num,
+            f"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /{base_font} "
+            f"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> "
+            f"/FontDescriptor {descriptor_num} 0 R /CIDToGIDMap /Identity /W [{widths}] >>",
+        )
+
+        unicode_num = writer.reserve()
+        writer.write_stream(unicode_num, self.to_unicode())
+
+        writer.write_object(
+            self.num,
+            f"<< /Type /Font /Subtype /Type0 /BaseFont /{base_font} /Encoding /Identity-H "
+            f"/DescendantFonts [{cid_num} 0 R] /ToUnicode {unicode_num} 0 R >>",
+        )
+
+
+class PdfExporter:
+    """
+    Writes laid-out pages as real PDF text in the handwriting font.
+
+    Glyphs are addressed by glyph id (Identity-H, CID = GID), so the calt
+    alternates HarfBuzz picked survive even though they have no Unicode value
+    of their own. Each font (a FontStack may hold fallbacks) is subset to the
+    glyphs actually used and embedded once at the end.
+
+    With a paper style (see paper.PAPER_STYLES) the rules are vector lines in
+    one Form XObject per page size that every page draws before its text.
+    """
+
+    def __init__(self, fp, font, size, dpi=72, paper=None):
+        self.writer = PdfWriter(fp)
+        self.size = size
+        self.scale = 72 / dpi
+        self.paper = paper
+        self.paper_forms = {}
+        self.page_nums = []
+
+        self.catalog_num = self.writer.reserve()
+        self.pages_num = self.writer.reserve()
+        # Subset tags only have to differ between fonts of one document
+        self.fonts = [
+            _EmbeddedFont(source, self.writer.reserve(), "HWSUB" + "SABCDEFGHIJKLMNOPQRTUVWXYZ"[i])
+            for i, source in enumerate(fonts_of(font))
+        ]
+
+    def add_page(self, page):
+        scale = self.scale
+        width_pt = page.width * scale
+        height_pt = page.height * scale
+        size_pt = self.size * scale
+
+        ops = ["BT"]
+        current = None
+        for run in page.runs:
+            pen_x, pen_y = run.x, run.y
+            tj = []
+            reposition = True
+            for g in run.glyphs:
+                embedded = self.fonts[g.font]
+                embedded.used.add(g.glyph_id)
+                if g.font != current or reposition or g.x_offset or g.y_offset:
+                    # Start a new positioned chunk
+                    if tj:
+                        ops.append("[" + "".join(tj) + "] TJ")
+                        tj = []
+                    if g.font != current:
+                        ops.append(f"/F{g.font + 1} {_fmt(size_pt)} Tf")
+                        current = g.font
+                    x = (pen_x + g.x_offset) / 64 * scale
+                    y = height_pt - (pen_y - g.y_offset) / 64 * scale
+                    ops.append(f"1 0 0 1 {_fmt(x)} {_fmt(y)} Tm")
+                tj.append(f"<{g.glyph_id:04X}>")
+
+                # Correct for any difference between HarfBuzz and the font's widths
+                actual = g.x_advance / 64 / self.size * 1000
+                adjust = embedded.glyph_width(g.glyph_id) - actual
+                if abs(adjust) > 0.001:
+                    tj.append(_fmt(adjust))
+
+                pen_x += g.x_advance
+                pen_y -= g.y_advance
+                reposition = bool(g.x_offset or g.y_offset or g.y_advance)
+            if tj:
+                ops.append("[" + "".join(tj) + "] TJ")
+        ops.append("ET")
+
+        resources = ""
+        if self.paper:
+            ops.insert(0, "/Paper Do")
+            resources = f"/XObject << /Paper {self._paper_form(width_pt, height_pt)} 0 R >> "
+
+        content_num = self.writer.reserve()
+        self.writer.write_stream(content_num, "\n".join(ops).encode("latin-1"))
+
+        fonts = " ".join(f"/F{i + 1} {embedded.num} 0 R" for i, embedded in enumerate(self.fonts))
+        page_num = self.writer.reserve()
+        self.writer.write_object(
+            page_num,
+            f"<< /Type /Page /Parent {self.pages_num} 0 R "
+            f"/MediaBox [0 0 {_fmt(width_pt)} {_fmt(height_pt)}] "
+            f"/Resources << /Font << {fonts} >> {resources}>> "
+            f"/Contents {content_num} 0 R >>",
+        )
+        self.page_nums.append(page_num)
+
+    def _paper_form(self, width_pt, height_pt):
+        key = (_fmt(width_pt), _fmt(height_pt))
+        num = self.paper_forms.get(key)
+        if num is None:
+            num = self.paper_forms[key] = self.writer.reserve()
+            self.writer.write_stream(
+                num, paper_form(self.paper, width_pt, height_pt),
+                f"/Type /XObject /Subtype /Form /BBox [0 0 {key[0]} {key[1]}] ",
+            )
+        return num
+
+    def close(self):
+        for embedded in self.fonts:
+            embedded.write(self.writer)
+        kids = " ".join(f"{num} 0 R" for num in self.page_nums)
+        self.writer.write_object(
+            self.pages_num,
+            f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_nums)} >>",
+        )
+        self.writer.write_object(self.catalog_num, f"<< /Type /Catalog /Pages {self.pages_num} 0 R >>")
+        self.writer.close(self.catalog_num)
+
+
+class ImagePdfExporter:
+    """
+    Writes rasterized pages as one full-page grey image each. Pages arrive
+    already deflated (see encode.pack_page), so they are copied through as-is.
+    """
+
+    def __init__(self, fp, dpi=72):
+        self.writer = PdfWriter(fp)
+        self.scale = 72 / dpi
+        self.page_nums = []
+        self.catalog_num = self.writer.reserve()
+        self.pages_num = self.writer.reserve()
+
+    def add_page(self, width, height, data, depth="gray"):
+        writer = self.writer
+        bits = 1 if depth == "1bit" else 8
+        image_num = writer.reserve()
+        writer.write_stream(
+            image_num, data,
+            f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace /DeviceGray /BitsPerComponent {bits} ",
+            compressed=True,
+        )
+
+        width_pt, height_pt = _fmt(width * self.scale), _fmt(height * self.scale)
+        content_num = writer.reserve()
+        writer.write_stream(content_num, f"q {width_pt} 0 0 {height_pt} 0 0 cm /Im1 Do Q".encode("latin-1"))
+
+        page_num = writer.reserve()
+        writer.write_object(
+            page_num,
+            f"<< /Type /Page /Parent {self.pages_num} 0 R /MediaBox [0 0 {width_pt} {height_pt}] "
+            f"/Resources << /XObject << /Im1 {image_num} 0 R >> >> /Contents {content_num} 0 R >>",
+        )
+        self.page_nums.append(page_num)
+
+    def close(self):
+        kids = " ".join(f"{num} 0 R" for num in self.page_nums)
+        self.writer.write_object(
+            self.pages_num,
+            f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_nums)} >>",
+        )
+        self.writer.write_object(self.catalog_num, f"<< /Type /Catalog /Pages {self.pages_num} 0 R >>")
+        self.writer.close(self.catalog_num)
+
+
+def export_pdf(pages, font, size, fp, dpi=72, paper=None):
+    """
+    Stream pages (any iterable, e.g. a generator) into a PDF written to fp.
+    Layout coordinates are pixels at `dpi`; 72 means one pixel per point.
+    """
+    exporter = PdfExporter(fp, font, size, dpi, paper)
+    for page in pages:
+        exporter.add_page(page)
+    exporter.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    from utils.font_registry import get_font
+    from utils.layout import layout_text
+
+    if len(sys.argv) != 3:
+        print("Usage: python -m utils.pdf_export input.txt output.pdf")
+        sys.exit(1)
+
+    with open(sys.argv[1], encoding="utf-8") as f:
+        text = f.read()
+
+    font = get_font("master_ttf/MyHandwriting.ttf")
+    pages = layout_text(font, text, 20, *A4_POINTS, margin=56)
+    with open(sys.argv[2], "wb") as out:
+        export_pdf(pages, font, 20, out)
+    print(f"✅ Wrote {len(pages)} pages to {sys.argv[2]}")
@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from utils.admission import Rejected
+
+# Previews are drawn at a third of the requested size, never below this
+PREVIEW_SCALE = 1 / 3
+MIN_PREVIEW_SIZE = 12
+# Seconds an announced render may take to be submitted before it is forgotten
+ANNOUNCE_TIMEOUT = 30
+
+
+def preview_size(size, scale=PREVIEW_SCALE):
+    return max(MIN_PREVIEW_SIZE, round(size * scale))
+
+
+class BackgroundRenders:
+    """
+    Full-resolution renders running behind a preview. Finished outputs go into
+    the render cache under their key; at most one render per key is in flight.
+    The renders run wherever submit()'s start puts them, so they are held to
+    the same queue and per-client limits as every other render.
+    """
+
+    def __init__(self, render_cache, max_rejected=256, announce_timeout=ANNOUNCE_TIMEOUT):
+        self.render_cache = render_cache
+        self.max_rejected = max_rejected
+        self.announce_timeout = announce_timeout
+        # key -> future of the running render, or when it was announced
+        self._pending = {}
+        # Renders that were turned away, so polls for them stop: key -> Rejected
+        self._rejected = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        # Announced renders whose response never closed are never submitted
+        deadline = time.monotonic() - self.announce_timeout
+        for key, entry in list(self._pending.items()):
+            if not isinstance(entry, Future) and entry < deadline:
+                del self._pending[key]
+
+    def announce(self, key):
+        # Report the key as pending before the render has actually been started
+        with self._lock:
+            self._expire()
+            self._pending.setdefault(key, time.monotonic())
+
+    def submit(self, key, start, create):
+        """
+        Render create() into the cache under key. start(work) queues work and
+        returns its future, or raises Rejected.
+        """
+        with self._lock:
+            if isinstance(self._pending.get(key), Future):
+                return
+            self._rejected.pop(key, None)
+            try:
+                future = start(lambda: self.render_cache.get_or_create(key, create))
+            except Rejected as error:
+                self._pending.pop(key, None)
+                self._rejected[key] = error
+                while len(self._rejected) > self.max_rejected:
+                    self._rejected.popitem(last=False)
+                return
+            self._pending[key] = future
+        future.add_done_callback(lambda _: self._done(key, future))
+
+    def _done(self, key, future):
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def status(self, key):
+        """
+        ("done", bytes), ("pending", None), ("rejected", Rejected) or
+        (None, None) for an unknown key.
+        """
+        with self._lock:
+            self._expire()
+            pending = key in self._pending
+            rejected = self._rejected.get(key)
+        data = self.render_cache.get(key)
+        if data is not None:
+            return "done", data
+        if pending:
+            return "pending", None
+        return ("rejected", rejected) if rejected else (None, None)
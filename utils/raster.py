@@ -0,0 +1,80 @@
+import numpy as np
+
+from utils.compositor import new_canvas, composite
+from utils.font_stack import fonts_of
+from utils.glyph_cache import rasterize_glyph, subpixel, SUBPIXEL_PHASES
+
+
+def render_page(page, font, size, glyph_cache=None, mode="L", scale=1, background=None,
+                jitter=None, seed=0, snap=False):
+    """
+    Rasterize one laid-out page into a new canvas, black ink on white.
+
+    With scale the layout is drawn at that scale, e.g. a preview using smaller
+    glyphs of `size` that keeps exactly the line breaks of the full render.
+    background is a grey image at least as large as the result (e.g. from
+    paper.paper_background) that is copied instead of starting from white.
+
+    With a jitter atlas (see jitter_atlas.JitterAtlas) each glyph of the
+    handwriting font is drawn as one of its transformed variants, picked by a
+    hash of seed, glyph and position, so repeated letters don't look stamped.
+
+    Pens stay in 26.6 fixed point and each glyph is placed to a quarter pixel
+    (SUBPIXEL_PHASES), using one cached bitmap per phase. snap=True rounds
+    every glyph to a whole pixel instead.
+    """
+    width, height = page.width, page.height
+    if scale != 1:
+        width, height = max(1, round(width * scale)), max(1, round(height * scale))
+    if background is None:
+        canvas = new_canvas(width, height, mode)
+    elif mode == "L":
+        canvas = background[:height, :width].copy()
+    else:
+        canvas = np.repeat(background[:height, :width, None], len(mode), axis=2)
+    fonts = fonts_of(font)
+    phases = 1 if snap else SUBPIXEL_PHASES
+
+    # Black ink over white is the inverted coverage, computed once per glyph
+    glyphs = {}
+    for run in page.runs:
+        pen_x, pen_y = run.x, run.y
+        for g in run.glyphs:
+            x, y = pen_x + g.x_offset, pen_y - g.y_offset
+            variant = jitter.pick(seed, x, y, g.glyph_id) if jitter is not None and g.font == 0 else None
+            if scale != 1:
+                x, y = int(x * scale), int(y * scale)
+            x, phase = subpixel(x, phases)
+            if variant is not None:
+                # Variants are whole-pixel bitmaps; their jitter dwarfs the phase
+                phase = 0
+
+            key = (g.font, g.glyph_id, variant, phase)
+            entry = glyphs.get(key)
+            if entry is None:
+                source = fonts[g.font]
+                face = source.ft_face(size)
+                if variant is not None:
+                    glyph = jitter.variant(face, source.hash, size, g.glyph_id, variant)
+                elif glyph_cache is not None:
+                    glyph = glyph_cache.get(face, source.hash, size, g.glyph_id, phase)
+                else:
+                    glyph = rasterize_glyph(face, g.glyph_id, phase)
+                ink = 255 - glyph.bitmap
+                entry = glyphs[key] = (glyph, ink[..., None] if canvas.ndim == 3 else ink)
+            glyph, ink = entry
+
+            x = x + glyph.left
+            y = y // 64 - glyph.top
+            h, w = glyph.bitmap.shape
+            if x >= 0 and y >= 0 and x + w <= width and y + h <= height:
+                dst = canvas[y:y + h, x:x + w]
+                np.minimum(dst, ink, out=dst)
+            else:
+                composite(canvas, glyph.bitmap, x, y, mode="min")
+
+            # HarfBuzz y grows upwards, image rows grow downwards
+            pen_x += g.x_advance
+            pen_y -= g.y_advance
+
+    return canvas
@@ -0,0 +1,28 @@
+import base64
+import io
+
+from flask import Response, request, send_file
+
+
+def data_uri(data, mimetype="image/png"):
+    # Lets an HTML page show (and download) the image without a second request
+    return f"data:{mimetype};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def is_fresh(etag):
+    """
+    True when the client already holds this exact version (strong comparison).
+    """
+    return request.if_none_match.contains(etag)
+
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def send_bytes(data, mimetype, download_name=None, etag=None):
+    # send_file also answers If-None-Match itself when given an etag
+    return send_file(io.BytesIO(data), mimetype=mimetype, etag=etag if etag else False,
+                     as_attachment=download_name is not None, download_name=download_name)
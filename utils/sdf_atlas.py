@@ -0,0 +1,208 @@
+import threading
+
+import cv2
+import numpy as np
+
+from utils.glyph_atlas import atlas_base, load_atlas, pack_glyphs, prune_atlases, save_atlas, ATLAS_WIDTH
+from utils.glyph_cache import CachedGlyph, GlyphCache, rasterize_glyph, SUBPIXEL_PHASES
+
+SDF_SIZE = 64       # em size, in pixels, the distance field is stored at
+OVERSAMPLE = 4      # outlines are rasterized this many times larger first
+SPREAD = 8          # distances are clamped to +/- this many SDF pixels
+PAD = SPREAD        # empty border kept around every glyph
+MIN_SIZE, MAX_SIZE = 12, 200
+
+
+def glyph_sdf(face, glyph_id):
+    """
+    Signed distance field of one glyph at SDF_SIZE, positive inside the ink.
+    The face must be set to SDF_SIZE * OVERSAMPLE.
+    Returns (field as uint8, left, top, advance), bearings in SDF pixels and
+    the advance in 26.6 SDF pixels.
+    """
+    glyph = rasterize_glyph(face, glyph_id)
+    advance = glyph.advance_x / OVERSAMPLE
+    h, w = glyph.bitmap.shape
+    if w == 0 or h == 0:
+        return np.zeros((0, 0), dtype=np.uint8), 0.0, 0.0, advance
+
+    # Pad, and round up so the high-res grid divides evenly
+    pad = PAD * OVERSAMPLE
+    out_h = -(-(h + 2 * pad) // OVERSAMPLE)
+    out_w = -(-(w + 2 * pad) // OVERSAMPLE)
+    ink = np.zeros((out_h * OVERSAMPLE, out_w * OVERSAMPLE), dtype=np.uint8)
+    ink[pad:pad + h, pad:pad + w] = glyph.bitmap >= 128
+
+    inside = cv2.distanceTransform(ink, cv2.DIST_L2, 5)
+    outside = cv2.distanceTransform(1 - ink, cv2.DIST_L2, 5)
+    # The edge sits half a pixel from the centres on either side
+    signed = np.where(ink > 0, inside - 0.5, 0.5 - outside)
+
+    field = cv2.resize(signed, (out_w, out_h), interpolation=cv2.INTER_AREA) / OVERSAMPLE
+    encoded = np.clip(128 + field * (127 / SPREAD), 0, 255).astype(np.uint8)
+    left = (glyph.left - pad) / OVERSAMPLE
+    top = (glyph.top + pad) / OVERSAMPLE
+    return encoded, left, top, advance
+
+
+def build_sdf_atlas(font):
+    """
+    Packed distance fields plus an index of (x, y, w, h, left, top, advance)
+    per glyph id.
+    """
+    face = font.ft_face(SDF_SIZE * OVERSAMPLE)
+    fields, metrics = [], []
+    for gid in range(face.num_glyphs):
+        field, *glyph_metrics = glyph_sdf(face, gid)
+        fields.append(field)
+        metrics.append(tuple(glyph_metrics))
+
+    positions, height = pack_glyphs(fields)
+    pixels = np.zeros((max(height, 1), ATLAS_WIDTH), dtype=np.uint8)
+    index = np.zeros((len(fields), 7), dtype=np.float32)
+    for i, (field, (x, y), m) in enumerate(zip(fields, positions, metrics)):
+        h, w = field.shape
+        pixels[y:y + h, x:x + w] = field
+        index[i] = (x, y, w, h) + m
+    return pixels, index
+
+
+class SdfAtlas:
+    """
+    Distance fields for every glyph, built once per font version. Any size
+    between MIN_SIZE and MAX_SIZE is produced by resampling and thresholding
+    the field with NumPy/OpenCV, without going back to FreeType; subpixel
+    phases are sampled from the field at their x offset, so a page never
+    mixes SDF and FreeType bitmaps. Results are kept in an LRU like ordinary
+    rasterized glyphs.
+
+    get() has the same signature as GlyphCache.get.
+    """
+
+    def __init__(self, font_hash, pixels, index, fallback=None, max_glyphs=4096):
+        self.font_hash = font_hash
+        self.pixels = pixels
+        self.index = index
+        self.fallback = fallback or GlyphCache()
+        # Glyph ids of this cache are (glyph id, phase) pairs
+        self.cache = GlyphCache(max_glyphs, rasterize=lambda face, size, key: self.render(size, *key))
+
+    def render(self, size, glyph_id, phase=0, phases=SUBPIXEL_PHASES):
+        x, y, w, h, left, top, advance = self.index[glyph_id].tolist()
+        scale = size / SDF_SIZE
+        advance_x = round(advance * scale)
+        if w == 0 or h == 0:
+            return CachedGlyph(np.zeros((0, 0), dtype=np.uint8), 0, 0, advance_x, 0)
+
+        # The field is sampled so the glyph's left edge lands exactly at its
+        # scaled bearing plus the phase; the whole pixels go into `left`
+        origin_x = left * scale + phase / phases
+        left_px = int(np.floor(origin_x))
+        top_px = round(top * scale)
+        dx, dy = origin_x - left_px, top_px - top * scale
+
+        x, y, w, h = int(x), int(y), int(w), int(h)
+        out_w, out_h = max(1, round(w * scale)) + 1, max(1, round(h * scale))
+        # Field pixel centres map to output pixel centres, shifted by (dx, dy)
+        matrix = np.float32([[scale, 0, 0.5 * scale - 0.5 + dx], [0, scale, 0.5 * scale - 0.5 + dy]])
+        field = cv2.warpAffine(self.pixels[y:y + h, x:x + w], matrix, (out_w, out_h),
+                               flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        # Distance in output pixels, then a one-pixel ramp across the edge
+        distance = (field.astype(np.float32) - 128) * (SPREAD / 127) * scale
+        coverage = (np.clip(distance + 0.5, 0, 1) * 255).astype(np.uint8)
+        return CachedGlyph(coverage, left_px, top_px, advance_x, 0)
+
+    def get(self, face, font_hash, size, glyph_id, phase=0):
+        if font_hash != self.font_hash or not MIN_SIZE <= size <= MAX_SIZE or glyph_id >= len(self.index):
+            return self.fallback.get(face, font_hash, size, glyph_id, phase)
+        return self.cache.get(face, font_hash, size, (glyph_id, phase))
+
+    def stats(self):
+        return self.cache.stats()
+
+
+def load_or_build_sdf_atlas(font, directory=None, fallback=None):
+    base = atlas_base(font, directory, kind="sdf-atlas")
+    saved = load_atlas(base)
+    if saved is None:
+        pixels, index = build_sdf_atlas(font)
+        pixels = save_atlas(base, pixels, index=index)
+        prune_atlases(font, directory)
+        return SdfAtlas(font.hash, pixels, index, fallback)
+
+    pixels, arrays = saved
+    return SdfAtlas(font.hash, pixels, arrays["index"], fallback)
+
+
+_atlases = {}
+_lock = threading.Lock()
+
+
+def get_sdf_atlas(font, directory=None, fallback=None):
+    """
+    SDF atlas for the current version of the font, loaded once per process.
+    """
+    key = (font.path, directory)
+    atlas = _atlases.get(key)
+    if atlas is None or atlas.font_hash != font.hash:
+        with _lock:
+            atlas = _atlases.get(key)
+            if atlas is None or atlas.font_hash != font.hash:
+                atlas = load_or_build_sdf_atlas(font, directory, fallback)
+                _atlases[key] = atlas
+    return atlas
+
+
+def benchmark(font, text, sizes=(12, 24, 48, 96, 160, 200), page_width=2400):
+    """
+    For each size, time producing every glyph of the font with FreeType versus
+    from the SDF atlas, then render the same layout both ways and report the
+    mean absolute difference over pixels either version inked: snapped to
+    whole pixels, and at the default subpixel phases.
+    """
+    import time
+
+    from utils.layout import layout_text
+    from utils.raster import render_page
+
+    atlas = get_sdf_atlas(font)
+    num_glyphs = len(atlas.index)
+    rows = []
+    for size in sizes:
+        start = time.perf_counter()
+        face = font.ft_face(size)
+        for gid in range(num_glyphs):
+            rasterize_glyph(face, gid)
+        direct_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        for gid in range(num_glyphs):
+            atlas.render(size, gid)
+        sdf_ms = (time.perf_counter() - start) * 1000
+
+        page = layout_text(font, text, size, page_width=page_width)[0]
+        errors = []
+        for snap in (True, False):
+            direct = render_page(page, font, size, GlyphCache(), snap=snap)
+            # No fallback cache, so every glyph it draws comes from the field
+            approx = render_page(page, font, size, SdfAtlas(atlas.font_hash, atlas.pixels, atlas.index,
+                                                            fallback=_NoFallback()), snap=snap)
+            inked = (direct < 255) | (approx < 255)
+            errors.append(np.abs(direct.astype(np.int16) - approx.astype(np.int16))[inked].mean())
+        rows.append((size, direct_ms, sdf_ms, *errors))
+    return rows
+
+
+class _NoFallback:
+    def get(self, *args):
+        raise AssertionError("glyph drawn without the SDF atlas")
+
+
+if __name__ == "__main__":
+    from utils.font_registry import get_font
+
+    font = get_font("master_ttf/MyHandwriting.ttf")
+    text = "the quick brown fox jumps over the lazy dog " * 4
+    print(f"{'size':>5} {'freetype ms':>12} {'sdf ms':>8} {'err snapped':>12} {'err phased':>11}")
+    for size, direct_ms, sdf_ms, snapped, phased in benchmark(font, text):
+        print(f"{size:>5} {direct_ms:>12.2f} {sdf_ms:>8.2f} {snapped:>12.1f} {phased:>11.1f}")
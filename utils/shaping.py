@@ -0,0 +1,169 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+import uharfbuzz as hb
+
+from utils.font_stack import FontStack
+
+# Positions are in 26.6 pixels at the size the font was scaled to. font is the
+# index of the font in a FontStack the glyph id belongs to (0 for a single font).
+ShapedGlyph = namedtuple(
+    "ShapedGlyph",
+    ["glyph_id", "cluster", "x_advance", "y_advance", "x_offset", "y_offset", "font"],
+    defaults=(0,),
+)
+
+DEFAULT_FEATURES = {"calt": True}
+
+# The calt rules only chain letter to letter, so whitespace always ends a context
+BREAK_CHARS = frozenset(" \t\n\r\f\v")
+
+
+def _segment_properties(text):
+    buf = hb.Buffer()
+    buf.add_str(text)
+    buf.guess_segment_properties()
+    return buf.direction, buf.script, buf.language
+
+
+def _shape_buffer(hb_font, text, props, features):
+    if not text:
+        return []
+    buf = hb.Buffer()
+    buf.add_str(text)
+    for name, value in zip(("direction", "script", "language"), props):
+        if value is not None:
+            setattr(buf, name, value)
+    # Fills in anything the whole text left undetermined (e.g. only whitespace)
+    buf.guess_segment_properties()
+    hb.shape(hb_font, buf, features)
+    return [
+        ShapedGlyph(info.codepoint, info.cluster, pos.x_advance, pos.y_advance, pos.x_offset, pos.y_offset)
+        for info, pos in zip(buf.glyph_infos, buf.glyph_positions)
+    ]
+
+
+def _shape_text(font, text, size, props, features):
+    if not isinstance(font, FontStack):
+        return _shape_buffer(font.hb_font(size), text, props, features)
+
+    # One buffer per run of characters the same font covers
+    pieces = font.split(text)
+    if props[0] == "rtl":
+        pieces.reverse()
+    glyphs = []
+    for start, end, index in pieces:
+        for g in _shape_buffer(font.fonts[index].hb_font(size), text[start:end], props, features):
+            glyphs.append(g._replace(cluster=g.cluster + start, font=index))
+    return glyphs
+
+
+def shape(font, text, size, features=None):
+    """
+    Shape the whole text in one HarfBuzz buffer per font, no caching.
+    """
+    if features is None:
+        features = DEFAULT_FEATURES
+    return _shape_text(font, text, size, _segment_properties(text), features)
+
+
+def split_runs(text):
+    """
+    Split text into words and single break characters, as (start, run) pairs.
+    """
+    runs = []
+    start = 0
+    for i, ch in enumerate(text):
+        if ch in BREAK_CHARS:
+            if i > start:
+                runs.append((start, text[start:i]))
+            runs.append((i, ch))
+            start = i + 1
+    if start < len(text):
+        runs.append((start, text[start:]))
+    return runs
+
+
+class ShapingCache:
+    """
+    LRU cache of shaped runs keyed by (font hash, size, features, segment
+    properties, word). Since no contextual rule reaches across a break
+    character, stitching cached words back together gives the same glyphs and
+    positions as shaping the whole buffer.
+    """
+
+    def __init__(self, max_runs=8192):
+        self.max_runs = max_runs
+        self._runs = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def shape_run(self, font, run, size, props, features):
+        key = (font.hash, size, tuple(sorted(features.items())), props, run)
+        with self._lock:
+            glyphs = self._runs.get(key)
+            if glyphs is not None:
+                self._runs.move_to_end(key)
+                self.hits += 1
+                return glyphs
+            self.misses += 1
+
+        glyphs = _shape_text(font, run, size, props, features)
+
+        with self._lock:
+            self._runs[key] = glyphs
+            while len(self._runs) > self.max_runs:
+                self._runs.popitem(last=False)
+                self.evictions += 1
+        return glyphs
+
+    def _shape_runs(self, font, text, size, props, features):
+        if features is None:
+            features = DEFAULT_FEATURES
+        return [
+            (start, run, self.shape_run(font, run, size, props, features))
+            for start, run in split_runs(text)
+        ]
+
+    def shape_runs(self, font, text, size, features=None):
+        """
+        Shape text word by word, returning (start, run, glyphs) in logical order.
+        Glyph clusters are relative to the run.
+        """
+        # Script and direction come from the whole text, as they would for one buffer
+        return self._shape_runs(font, text, size, _segment_properties(text), features)
+
+    def shape(self, font, text, size, features=None):
+        props = _segment_properties(text)
+        runs = self._shape_runs(font, text, size, props, features)
+        if props[0] == "rtl":
+            runs.reverse()
+
+        glyphs = []
+        for start, run, run_glyphs in runs:
+            for g in run_glyphs:
+                glyphs.append(g._replace(cluster=g.cluster + start))
+        return glyphs
+
+    def clear(self):
+        with self._lock:
+            self._runs.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._runs),
+                "max_runs": self.max_runs,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+default_cache = ShapingCache()
+
+
+def shape_text(font, text, size, features=None):
+    return default_cache.shape(font, text, size, features)
@@ -0,0 +1,72 @@
+from collections import defaultdict
+
+from utils.compositor import new_canvas, composite
+from utils.encode import write_png_bands, write_tiff_bands
+from utils.glyph_cache import GlyphCache
+
+BAND_HEIGHT = 256
+
+
+class TileRasterizer:
+    """
+    Renders a width x height image in horizontal bands instead of one canvas.
+
+    Glyph placements are bucketed by the bands their bitmaps touch, so each
+    band is composited only from the glyphs that intersect it. Peak memory is
+    one band plus the index, however tall the image is.
+
+    Placements are (glyph id, x, y), optionally followed by a font index and
+    a subpixel phase (see glyph_cache.subpixel). Font index 0 is
+    face/font_hash and index i is fallbacks[i - 1], a (face, hash) pair.
+    """
+
+    def __init__(self, width, height, face, font_hash, size, placements, glyph_cache=None,
+                 band_height=BAND_HEIGHT, ink=0, background=255, mode="min", fallbacks=()):
+        self.width = width
+        self.height = height
+        self.sources = [(face, font_hash), *fallbacks]
+        self.size = size
+        self.glyph_cache = glyph_cache or GlyphCache()
+        self.band_height = band_height
+        self.ink = ink
+        self.background = background
+        self.mode = mode
+
+        # band number -> [(font index, glyph id, phase, left, top)] of every glyph crossing it
+        self.index = defaultdict(list)
+        for glyph_id, x, y, *extra in placements:
+            font, phase = (*extra, 0, 0)[:2]
+            glyph = self._glyph(font, glyph_id, phase)
+            rows = glyph.bitmap.shape[0]
+            left, top = x + glyph.left, y - glyph.top
+            y0, y1 = max(top, 0), min(top + rows, height)
+            if y0 >= y1:
+                continue
+            for band in range(y0 // band_height, (y1 - 1) // band_height + 1):
+                self.index[band].append((font, glyph_id, phase, left, top))
+
+    def _glyph(self, font, glyph_id, phase=0):
+        face, font_hash = self.sources[font]
+        return self.glyph_cache.get(face, font_hash, self.size, glyph_id, phase)
+
+    def bands(self):
+        """
+        Yield each band as a (rows, width) uint8 array, top to bottom.
+        """
+        for band, y0 in enumerate(range(0, self.height, self.band_height)):
+            rows = min(self.band_height, self.height - y0)
+            canvas = new_canvas(self.width, rows, background=self.background)
+            for font, glyph_id, phase, left, top in self.index.pop(band, ()):
+                glyph = self._glyph(font, glyph_id, phase)
+                composite(canvas, glyph.bitmap, left, top - y0, ink=self.ink, mode=self.mode)
+            yield canvas
+
+    def write(self, fp, fmt="png", depth="gray"):
+        if fmt == "tiff":
+            write_tiff_bands(fp, self.width, self.height, self.bands(), depth, self.band_height)
+        else:
+            write_png_bands(fp, self.width, self.height, self.bands(), depth)
+
+
+def format_for(path):
+    return "tiff" if path.lower().endswith((".tif", ".tiff")) else "png"